@@ -12,6 +12,7 @@ def make_target(toolchain, host, target):
 
 class Android(object):
   def __init__(self, toolchain, host, target):
+    self.toolchain = toolchain
     self.host = host
 
     if host.is_windows():
@@ -81,7 +82,7 @@ class Android(object):
       else:
         self.hostarchname = 'windows-x86'
     elif self.host.is_linux():
-        localarch = toolchain.check_output(['uname', '-m'])
+        localarch = self.toolchain.probes.check_output(['uname', '-m'])
         if localarch == 'x86_64':
           self.hostarchname = 'linux-x86_64'
         else:
@@ -184,7 +185,7 @@ class Android(object):
     manifestfile = []
 
     writer.comment('Make APK')
-    for _, value in archbins.iteritems():
+    for _, value in archbins.items():
       for archbin in value:
         archpair = os.path.split(archbin)
         libname = archpair[1]
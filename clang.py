@@ -34,8 +34,8 @@ class ClangToolchain(toolchain.Toolchain):
       self.deploymenttarget = '12.0'
 
     #Command definitions
-    self.cccmd = '$toolchain$cc -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags $cenvflags -c $in -o $out'
-    self.cxxcmd = '$toolchain$cxx -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags $cxxenvflags -c $in -o $out'
+    self.cccmd = '$ccenv$launcher$toolchain$cc -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags $pchflags $cenvflags -c $in -o $out'
+    self.cxxcmd = '$cxxenv$launcher$toolchain$cxx -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags $pchflags $cxxenvflags -c $in -o $out'
     self.ccdeps = 'gcc'
     self.ccdepfile = '$out.d'
     self.arcmd = self.rmcmd('$out') + ' && $toolchain$ar crsD $ararchflags $arflags $arenvflags $out $in'
@@ -104,6 +104,8 @@ class ClangToolchain(toolchain.Toolchain):
       self.cflags += self.cwarnflags
     else:
       self.cflags += ['-w']
+    if self.prefix_map:
+      self.cflags += self.prefix_map_flags()
     self.cxxflags = list(self.cflags)
 
     self.cflags += ['-std=c11']
@@ -162,8 +164,8 @@ class ClangToolchain(toolchain.Toolchain):
     writer.variable('toolchain', self.toolchain)
     writer.variable('sdkpath', self.sdkpath)
     writer.variable('sysroot', self.sysroot)
-    writer.variable('cc', self.ccompiler)
-    writer.variable('cxx', self.cxxcompiler)
+    self.write_compiler_variable(writer, 'cc', self.ccompiler)
+    self.write_compiler_variable(writer, 'cxx', self.cxxcompiler)
     writer.variable('ar', self.archiver)
     writer.variable('link', self.linker)
     if self.target.is_macos() or self.target.is_ios():
@@ -199,19 +201,30 @@ class ClangToolchain(toolchain.Toolchain):
 
   def write_rules(self, writer):
     super(ClangToolchain, self).write_rules(writer)
-    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CC $in')
-    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CXX $in')
+    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CC $in')
+    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CXX $in')
+    writer.rule('ccpch', command = self.pchcmd(self.cccmd, 'c-header'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+    writer.rule('cxxpch', command = self.pchcmd(self.cxxcmd, 'c++-header'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
     if self.target.is_macos() or self.target.is_ios():
-      writer.rule('cm', command = self.cmcmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CM $in')
-      writer.rule( 'lipo', command = self.lipocmd, description = 'LIPO $out' )
-    writer.rule('ar', command = self.arcmd, description = 'LIB $out')
-    writer.rule('link', command = self.linkcmd, description = 'LINK $out')
+      writer.rule('cm', command = self.cmcmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CM $in')
+      writer.rule('cmpch', command = self.pchcmd(self.cmcmd, 'objective-c-header'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+      writer.rule( 'lipo', command = self.lipocmd, pool = self.link_pool(), description = 'LIPO $out' )
+    writer.rule('ar', command = self.arcmd, pool = self.link_pool(), description = 'LIB $out')
+    writer.rule('link', command = self.linkcmd, pool = self.link_pool(), description = 'LINK $out')
     if self.target.is_windows():
-      writer.rule('dll', command = self.dllcmd, description = 'DLL $out')
+      writer.rule('dll', command = self.dllcmd, pool = self.link_pool(), description = 'DLL $out')
     else:
-      writer.rule('so', command = self.linkcmd, description = 'SO $out')
+      writer.rule('so', command = self.linkcmd, pool = self.link_pool(), description = 'SO $out')
     writer.newline()
 
+  def probe_commands(self):
+    commands = super(ClangToolchain, self).probe_commands()
+    if self.target.is_macos() or self.target.is_ios():
+      sdk = 'macosx' if self.target.is_macos() else 'iphoneos'
+      commands += [['xcrun', '--sdk', sdk, '--show-sdk-platform-path'], ['xcrun', '--sdk', sdk, '--show-sdk-path']]
+      commands += [['xcrun', '--sdk', sdk, '-f', tool] for tool in ['clang', 'libtool', 'lipo']]
+    return commands
+
   def build_toolchain(self):
     super(ClangToolchain, self).build_toolchain()
     if self.target.is_windows():
@@ -261,15 +274,15 @@ class ClangToolchain(toolchain.Toolchain):
       self.linkflags += ['-isysroot', '$sysroot']
     self.cflags += ['-fembed-bitcode-marker']
 
-    platformpath = toolchain.check_output(['xcrun', '--sdk', sdk, '--show-sdk-platform-path'])
+    platformpath = self.probes.check_output(['xcrun', '--sdk', sdk, '--show-sdk-platform-path'])
     localpath = platformpath + "/Developer/usr/bin:/Applications/Xcode.app/Contents/Developer/usr/bin:/usr/bin:/bin:/usr/sbin:/sbin"
 
-    self.sysroot = toolchain.check_output(['xcrun', '--sdk', sdk, '--show-sdk-path'])
+    self.sysroot = self.probes.check_output(['xcrun', '--sdk', sdk, '--show-sdk-path'])
 
-    self.ccompiler = "PATH=" + localpath + " " + toolchain.check_output(['xcrun', '--sdk', sdk, '-f', 'clang'])
-    self.archiver = "PATH=" + localpath + " " + toolchain.check_output(['xcrun', '--sdk', sdk, '-f', 'libtool'])
+    self.ccompiler = "PATH=" + localpath + " " + self.probes.check_output(['xcrun', '--sdk', sdk, '-f', 'clang'])
+    self.archiver = "PATH=" + localpath + " " + self.probes.check_output(['xcrun', '--sdk', sdk, '-f', 'libtool'])
     self.linker = deploytarget + " " + self.ccompiler
-    self.lipo = "PATH=" + localpath + " " + toolchain.check_output(['xcrun', '--sdk', sdk, '-f', 'lipo'])
+    self.lipo = "PATH=" + localpath + " " + self.probes.check_output(['xcrun', '--sdk', sdk, '-f', 'lipo'])
 
     self.mflags += list(self.cflags) + ['-fobjc-arc', '-fno-objc-exceptions', '-x', 'objective-c']
     self.cflags += ['-x', 'c']
@@ -428,6 +441,7 @@ class ClangToolchain(toolchain.Toolchain):
       return ['-framework ' + framework for framework in frameworks]
     return []
 
+  @toolchain.memoize
   def make_configlibpaths(self, config, arch, extralibpaths):
     libpaths = [self.libpath, os.path.join(self.libpath, config)]
     if not self.target.is_macos() and not self.target.is_ios():
@@ -457,6 +471,8 @@ class ClangToolchain(toolchain.Toolchain):
       localvariables += [('sysroot', self.android.make_sysroot_path(arch))]
     if 'defines' in variables:
       localvariables += [('cmoreflags', ['-D' + define for define in variables['defines']])]
+    if 'pchflags' in variables:
+      localvariables += [('pchflags', variables['pchflags'])]
     return localvariables
 
   def ar_variables(self, config, arch, targettype, variables):
@@ -507,14 +523,34 @@ class ClangToolchain(toolchain.Toolchain):
 
     return localvariables
 
+  def compile_launcher(self):
+    if self.objcache:
+      return self.objcache_launcher()
+    return self.launcher
+
+  def pchcmd(self, command, language):
+    return command.replace(' -c $in', ' -x ' + language + ' -c $in')
+
+  def precompile_header(self, writer, config, arch, targettype, kind, header, modulepath, variables):
+    rule = {'c': 'cc', 'cpp': 'cxx', 'm': 'cm'}[kind]
+    command = {'c': self.cccmd, 'cpp': self.cxxcmd, 'm': self.cmcmd}[kind]
+    language = {'c': 'c-header', 'cpp': 'c++-header', 'm': 'objective-c-header'}[kind]
+    outfile = os.path.join(modulepath, 'pch', os.path.splitext(os.path.basename(header))[0] + '-' + kind + '.pch')
+    rule, localvariables = self.compile_rule(writer, rule + 'pch', self.pchcmd(command, language), 'PCH $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    writer.build(outfile, rule, header, implicit = self.implicit_deps(config, variables), variables = localvariables)
+    return [outfile], ['-include-pch', outfile], []
+
   def builder_cc(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cc', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cc', self.cccmd, 'CC $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_cxx(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cxx', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cxx', self.cxxcmd, 'CXX $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_cm(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cm', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cm', self.cmcmd, 'CM $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_lib(self, writer, config, arch, targettype, infiles, outfile, variables):
     return writer.build(outfile, 'ar', infiles, implicit = self.implicit_deps(config, variables), variables = self.ar_variables(config, arch, targettype, variables))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Cached directory listings for source globbing
+
+Listings are stored in a JSON file in the build directory together with the
+modification time of the directory they were read from. Adding, removing or
+renaming an entry updates the mtime of its directory, so a listing is reused
+as long as the mtime is unchanged, and an unchanged subtree is walked without
+reading any directory.
+"""
+
+import fnmatch
+import json
+import os
+
+#Bump to discard caches written by an incompatible version
+cache_version = 1
+
+class DirectoryCache(object):
+  def __init__(self, filename):
+    self.filename = filename
+    self.listings = None
+    self.dirty = False
+    self.scanned = {}
+    self.reads = 0
+
+  def load(self):
+    if self.listings is not None:
+      return
+    self.listings = {}
+    if not os.path.isfile(self.filename):
+      return
+    try:
+      with open(self.filename, 'r') as cachefile:
+        cache = json.load(cachefile)
+    except (OSError, ValueError):
+      return
+    if cache.get('version') == cache_version:
+      self.listings = cache.get('directories', {})
+
+  def save(self):
+    if not self.dirty:
+      return
+    path = os.path.dirname(self.filename)
+    if path != '' and not os.path.isdir(path):
+      os.makedirs(path)
+    tmpfile = self.filename + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpfile, 'w') as cachefile:
+      json.dump({'version': cache_version, 'directories': self.listings}, cachefile, sort_keys = True)
+    os.replace(tmpfile, self.filename)
+    self.dirty = False
+
+  def listdir(self, path):
+    """Files and subdirectories in path as a pair of sorted lists, read from the
+    cache if the directory is unchanged since it was listed"""
+    self.load()
+    mtime = os.stat(path).st_mtime_ns
+    self.scanned[path] = True
+    listing = self.listings.get(path)
+    if listing is not None and listing[0] == mtime:
+      return listing[1], listing[2]
+    files = []
+    directories = []
+    for entry in os.scandir(path):
+      if entry.is_dir():
+        directories += [entry.name]
+      else:
+        files += [entry.name]
+    files.sort()
+    directories.sort()
+    self.listings[path] = [mtime, files, directories]
+    self.dirty = True
+    self.reads += 1
+    return files, directories
+
+  def glob(self, path, patterns, recursive = False, exclude = None):
+    """Paths relative to path of the files matching any of the patterns and none of
+    the exclude patterns. Files of a directory are returned in sorted order, before
+    those of its subdirectories. Patterns match either the name or the relative path"""
+    matches = []
+    def matching(name, relpath, patterns):
+      return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern) for pattern in patterns)
+    def walk(subpath):
+      files, directories = self.listdir(os.path.join(path, subpath) if subpath else path)
+      for name in files:
+        relpath = os.path.join(subpath, name) if subpath else name
+        if matching(name, relpath, patterns) and not matching(name, relpath, exclude or []):
+          matches.append(relpath)
+      if recursive:
+        for name in directories:
+          relpath = os.path.join(subpath, name) if subpath else name
+          if not matching(name, relpath, exclude or []):
+            walk(relpath)
+    walk('')
+    return matches
@@ -20,8 +20,8 @@ class GCCToolchain(toolchain.Toolchain):
     self.cxxlinker = os.environ.get('CXX') or 'g++'
 
     #Command definitions
-    self.cccmd = '$toolchain$cc -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags $cenvflags -c $in -o $out'
-    self.cxxcmd = '$toolchain$cxx -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags $cxxenvflags -c $in -o $out'
+    self.cccmd = '$ccenv$launcher$toolchain$cc -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags $pchflags $cenvflags -c $in -o $out'
+    self.cxxcmd = '$cxxenv$launcher$toolchain$cxx -MMD -MT $out -MF $out.d $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags $pchflags $cxxenvflags -c $in -o $out'
     self.ccdeps = 'gcc'
     self.ccdepfile = '$out.d'
     self.arcmd = self.rmcmd('$out') + ' && $toolchain$ar crsD $ararchflags $arflags $arenvflags $out $in'
@@ -72,6 +72,8 @@ class GCCToolchain(toolchain.Toolchain):
 
     if not 'nowarning' in variables or not variables['nowarning']:
       self.cflags += self.cwarnflags
+    if self.prefix_map:
+      self.cflags += self.prefix_map_flags()
     self.cxxflags = list(self.cflags)
 
     self.cflags += ['-std=c11']
@@ -112,8 +114,8 @@ class GCCToolchain(toolchain.Toolchain):
   def write_variables(self, writer):
     super(GCCToolchain, self).write_variables(writer)
     writer.variable('toolchain', self.toolchain)
-    writer.variable('cc', self.ccompiler)
-    writer.variable('cxx', self.cxxcompiler)
+    self.write_compiler_variable(writer, 'cc', self.ccompiler)
+    self.write_compiler_variable(writer, 'cxx', self.cxxcompiler)
     writer.variable('ar', self.archiver)
     writer.variable('link', self.linker)
     writer.variable('includepaths', self.make_includepaths(self.includepaths))
@@ -142,11 +144,13 @@ class GCCToolchain(toolchain.Toolchain):
 
   def write_rules(self, writer):
     super(GCCToolchain, self).write_rules(writer)
-    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CC $in')
-    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CXX $in')
-    writer.rule('ar', command = self.arcmd, description = 'LIB $out')
-    writer.rule('link', command = self.linkcmd, description = 'LINK $out')
-    writer.rule('so', command = self.linkcmd, description = 'SO $out')
+    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CC $in')
+    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CXX $in')
+    writer.rule('ccpch', command = self.pchcmd(self.cccmd, 'c-header'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+    writer.rule('cxxpch', command = self.pchcmd(self.cxxcmd, 'c++-header'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+    writer.rule('ar', command = self.arcmd, pool = self.link_pool(), description = 'LIB $out')
+    writer.rule('link', command = self.linkcmd, pool = self.link_pool(), description = 'LINK $out')
+    writer.rule('so', command = self.linkcmd, pool = self.link_pool(), description = 'SO $out')
     writer.newline()
 
   def build_target_toolchain(self, target):
@@ -241,6 +245,7 @@ class GCCToolchain(toolchain.Toolchain):
       return ['-l' + lib for lib in libs]
     return []
 
+  @toolchain.memoize
   def make_configlibpaths(self, config, arch, extralibpaths):
     libpaths = [
       self.libpath,
@@ -269,6 +274,8 @@ class GCCToolchain(toolchain.Toolchain):
       localvariables += [('cconfigflags', cconfigflags)]
     if 'defines' in variables:
       localvariables += [('cmoreflags', ['-D' + define for define in variables['defines']])]
+    if 'pchflags' in variables:
+      localvariables += [('pchflags', variables['pchflags'])]
     return localvariables
 
   def ar_variables(self, config, arch, targettype, variables):
@@ -303,11 +310,39 @@ class GCCToolchain(toolchain.Toolchain):
 
     return localvariables
 
+  def compile_launcher(self):
+    if self.objcache:
+      return self.objcache_launcher()
+    return self.launcher
+
+  def pchcmd(self, command, language):
+    return command.replace(' -c $in', ' -x ' + language + ' -c $in')
+
+  def precompiled_header_source(self, header, decoratedmodule):
+    #Precompile a header including the module header, as gcc warns about #pragma once
+    #in a header compiled as main file
+    source = os.path.join(self.buildpath, 'pch', decoratedmodule, os.path.basename(header))
+    toolchain.write_if_changed(source, '#include "' + header.replace('\\', '/') + '"\n')
+    self.generated_files += [source]
+    return source
+
+  def precompile_header(self, writer, config, arch, targettype, kind, header, modulepath, variables):
+    #Sources use the header through -include, which gcc resolves to the .gch next to it
+    rule = {'c': 'cc', 'cpp': 'cxx'}[kind]
+    command = {'c': self.cccmd, 'cpp': self.cxxcmd}[kind]
+    language = {'c': 'c-header', 'cpp': 'c++-header'}[kind]
+    includefile = os.path.join(modulepath, 'pch-' + kind, os.path.basename(header))
+    rule, localvariables = self.compile_rule(writer, rule + 'pch', self.pchcmd(command, language), 'PCH $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    writer.build(includefile + '.gch', rule, header, implicit = self.implicit_deps(config, variables), variables = localvariables)
+    return [includefile + '.gch'], ['-include', includefile, '-Winvalid-pch'], []
+
   def builder_cc(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cc', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cc', self.cccmd, 'CC $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_cxx(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cxx', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cxx', self.cxxcmd, 'CXX $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_lib(self, writer, config, arch, targettype, infiles, outfile, variables):
     return writer.build(outfile, 'ar', infiles, implicit = self.implicit_deps(config, variables), variables = self.ar_variables(config, arch, targettype, variables))
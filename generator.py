@@ -3,56 +3,161 @@
 """Ninja build generator"""
 
 import argparse
+import atexit
+import collections
+import dis
+import filecmp
+import json
 import os
 import pipes
+import subprocess
 import sys
+import traceback
 
+import dircache
+import graph
 import platform
 import toolchain
 import syntax
+import watch
+
+def replace_if_changed(tmpfile, filename):
+  """Move tmpfile over filename if the content differs, otherwise discard it,
+  leaving filename and its modification time untouched"""
+  if os.path.isfile(filename) and filecmp.cmp(tmpfile, filename, shallow = False):
+    os.remove(tmpfile)
+    return False
+  os.replace(tmpfile, filename)
+  return True
+
+def main_frame():
+  #Outermost frame of the running script
+  frame = sys._getframe(1)
+  while frame.f_back is not None:
+    frame = frame.f_back
+  return frame
+
+def completed(frame):
+  #A finished frame run to completion stops at a return, one left by an exception or
+  #sys.exit stops at the instruction raising it
+  return dis.opname[frame.f_code.co_code[frame.f_lasti]] in ['RETURN_VALUE', 'RETURN_CONST']
+
+def make_parser():
+  parser = argparse.ArgumentParser(description = 'Ninja build generator')
+  parser.add_argument('-t', '--target',
+                      help = 'Target platform',
+                      choices = platform.supported_platforms())
+  parser.add_argument('--host',
+                      help = 'Host platform',
+                      choices = platform.supported_platforms())
+  parser.add_argument('--toolchain',
+                      help = 'Toolchain to use',
+                      choices = toolchain.supported_toolchains())
+  parser.add_argument('-c', '--config', action = 'append',
+                      help = 'Build configuration',
+                      choices = ['debug', 'release', 'profile', 'deploy'],
+                      default = [])
+  parser.add_argument('-a', '--arch', action = 'append',
+                      help = 'Add architecture',
+                      choices = toolchain.supported_architectures(),
+                      default = [])
+  parser.add_argument('-i', '--includepath', action = 'append',
+                      help = 'Add include path',
+                      default = [])
+  parser.add_argument('--monolithic', action='store_true',
+                      help = 'Build monolithic test suite',
+                      default = False)
+  parser.add_argument('--coverage', action='store_true',
+                      help = 'Build with code coverage',
+                      default = False)
+  parser.add_argument('--subninja', action='store',
+                      help = 'Build as subproject (exclude rules and pools) with the given subpath',
+                      default = '')
+  parser.add_argument('--buildprefs', action='store',
+                      help = 'Read the given build preferences file',
+                      default = '')
+  parser.add_argument('--updatebuild', action='store_true',
+                      help = 'Update submodule build scripts',
+                      default = '')
+  parser.add_argument('--lto', action='store_true',
+                      help = 'Build with Link Time Optimization',
+                      default = False)
+  parser.add_argument('--compact', action='store_true',
+                      help = 'Write build file without line wrapping',
+                      default = False)
+  parser.add_argument('--specializerules', action='store_true',
+                      help = 'Fold per-edge compile flags into specialized rules',
+                      default = False)
+  parser.add_argument('--unity', action='store_true',
+                      help = 'Compile sources grouped into unity translation units',
+                      default = False)
+  parser.add_argument('-j', '--jobs', type=int,
+                      help = 'Number of worker processes generating config and arch slices in parallel',
+                      default = 1)
+  parser.add_argument('--only', action='append',
+                      help = 'Only generate the given comma separated modules and the modules they depend on',
+                      default = [])
+  parser.add_argument('--buildfile', action='store',
+                      help = 'Name of the top level build file',
+                      default = 'build.ninja')
+  parser.add_argument('--variant', action='store',
+                      help = 'Variant name added to the build, lib and bin directories of the target',
+                      default = '')
+  parser.add_argument('--workspace', action='store_true',
+                      help = 'Generate dependent libs as subninja parts of this build',
+                      default = False)
+  parser.add_argument('--watch', action='store_true',
+                      help = 'Keep running, building affected targets and running affected tests when files change',
+                      default = False)
+  parser.add_argument('--affected', action='append',
+                      help = 'Print the targets and test binaries affected by the given changed file as JSON, - to read files from stdin',
+                      default = [])
+  parser.add_argument('--default', action='append',
+                      help = 'Build the given comma separated aliases by default, like debug, x86-64-release or native for the host arch in debug',
+                      default = [])
+  parser.add_argument('--partition', action='store_true',
+                      help = 'Write one build file per config and architecture',
+                      default = False)
+  return parser
+
+#Options acting once on a configure run rather than describing the build, left out of the
+#arguments build files are regenerated with, mapped to whether they take a value
+oneshot_options = {'--watch': False, '--affected': True}
+
+def configure_arguments(args):
+  arguments = []
+  args = iter(args)
+  for arg in args:
+    name = arg.split('=', 1)[0]
+    if name in oneshot_options:
+      if oneshot_options[name] and not '=' in arg:
+        next(args, None)
+      continue
+    arguments += [arg]
+  return arguments
+
+def make_options(values = None):
+  """Generator options with defaults, overridden by a dict keyed on the option names
+  as used on the command line, for example {'target': 'linux', 'arch': ['x86-64']}"""
+  options = make_parser().parse_args([])
+  for key, value in (values or {}).items():
+    key = key.replace('-', '_')
+    if not hasattr(options, key):
+      raise Exception('Unknown generator option: ' + key)
+    if key in ['arch', 'config', 'includepath', 'only'] and isinstance(value, str):
+      value = [value]
+    setattr(options, key, value)
+  return options
 
 class Generator(object):
-  def __init__(self, project, includepaths = [], dependlibs = [], libpaths = [], variables = None):
-    parser = argparse.ArgumentParser(description = 'Ninja build generator')
-    parser.add_argument('-t', '--target',
-                        help = 'Target platform',
-                        choices = platform.supported_platforms())
-    parser.add_argument('--host',
-                        help = 'Host platform',
-                        choices = platform.supported_platforms())
-    parser.add_argument('--toolchain',
-                        help = 'Toolchain to use',
-                        choices = toolchain.supported_toolchains())
-    parser.add_argument('-c', '--config', action = 'append',
-                        help = 'Build configuration',
-                        choices = ['debug', 'release', 'profile', 'deploy'],
-                        default = [])
-    parser.add_argument('-a', '--arch', action = 'append',
-                        help = 'Add architecture',
-                        choices = toolchain.supported_architectures(),
-                        default = [])
-    parser.add_argument('-i', '--includepath', action = 'append',
-                        help = 'Add include path',
-                        default = [])
-    parser.add_argument('--monolithic', action='store_true',
-                        help = 'Build monolithic test suite',
-                        default = False)
-    parser.add_argument('--coverage', action='store_true',
-                        help = 'Build with code coverage',
-                        default = False)
-    parser.add_argument('--subninja', action='store',
-                        help = 'Build as subproject (exclude rules and pools) with the given subpath',
-                        default = '')
-    parser.add_argument('--buildprefs', action='store',
-                        help = 'Read the given build preferences file',
-                        default = '')
-    parser.add_argument('--updatebuild', action='store_true',
-                        help = 'Update submodule build scripts',
-                        default = '')
-    parser.add_argument('--lto', action='store_true',
-                        help = 'Build with Link Time Optimization',
-                        default = False)
-    options = parser.parse_args()
+  def __init__(self, project, includepaths = [], dependlibs = [], libpaths = [], variables = None, options = None, probes = None):
+    #Options are parsed from the command line unless given as a dict or parsed options,
+    #in which case the caller closes the generator to write the build files
+    commandline = options is None
+    if commandline:
+      options = make_parser().parse_args()
+    elif isinstance(options, dict):
+      options = make_options(options)
 
     self.project = project
     self.target = platform.Platform(options.target)
@@ -60,30 +165,70 @@ class Generator(object):
     self.subninja = options.subninja
     archs = options.arch
     configs = options.config
-    if includepaths is None:
-      includepaths = []
+    includepaths = list(includepaths or [])
     if not options.includepath is None:
       includepaths += options.includepath
 
-    buildfile = open('build.ninja', 'w')
-    self.writer = syntax.Writer(buildfile)
+    self.toolchain = toolchain.make_toolchain(self.host, self.target, options.toolchain)
+    self.toolchain.buildprefs = options.buildprefs
+    if options.variant != '':
+      self.toolchain.initialize_variant(options.variant)
+    #Generators rerun by a watch session share its caches and are closed by it
+    if watch.session is not None:
+      watch.session.generators += [self]
+      probes = watch.session.probes
+      commandline = False
+    self.watch = options.watch and watch.session is None
+    self.affected_files = options.affected
+
+    #A probe cache given by the caller is shared with other generators and saved by the caller
+    self.shared_probes = probes is not None
+    if self.shared_probes:
+      self.toolchain.probes = probes
 
-    self.writer.variable('ninja_required_version', '1.3')
-    self.writer.newline()
+    #Output files are built as graphs streamed to staging files, replaced atomically when
+    #generation completes. Graphs queried after generation are kept in memory instead
+    self.compact = options.compact
+    self.keep_graphs = bool(self.affected_files) or self.watch or watch.session is not None
+    self.writers = []
+    self.configure_depends = [sys.argv[0]]
+    self.workspace_files = []
+    self.configure_depfile = os.path.join(self.toolchain.buildpath, 'configure.d')
+    self.directories = dircache.DirectoryCache(os.path.join(self.toolchain.buildpath, 'directories.json'))
+    if watch.session is not None:
+      self.directories = watch.session.directories
+    self.binaries = []
+    self.slice_writers = {}
+    self.closed = False
+    self.buildfile = options.buildfile
+    self.writer = self.open_writer(self.buildfile)
 
-    self.writer.comment('configure.py arguments')
-    self.writer.variable('configure_args', ' '.join(sys.argv[1:]))
-    self.writer.newline()
+    #When partitioned, variables and rules are shared by the top level and per-slice build files
+    self.rulesfile = None
+    headerwriter = self.writer
+    if options.partition:
+      self.rulesfile = os.path.join(self.toolchain.buildpath, 'rules.ninja')
+      headerwriter = self.open_writer(self.rulesfile)
+      self.writer.include(self.rulesfile)
+      self.writer.newline()
+      self.toolchain.slice_writer = self.slice_writer
 
-    self.writer.comment('configure options')
-    self.writer.variable('configure_target', self.target.platform)
-    self.writer.variable('configure_host', self.host.platform)
+    headerwriter.variable('ninja_required_version', '1.3')
+    headerwriter.newline()
+
+    headerwriter.comment('configure.py arguments')
+    headerwriter.variable('configure_args', ' '.join(configure_arguments(sys.argv[1:])))
+    headerwriter.newline()
+
+    headerwriter.comment('configure options')
+    headerwriter.variable('configure_target', self.target.platform)
+    headerwriter.variable('configure_host', self.host.platform)
 
     env_keys = set(['CC', 'AR', 'LINK', 'CFLAGS', 'ARFLAGS', 'LINKFLAGS'])
     configure_env = dict((key, os.environ[key]) for key in os.environ if key in env_keys)
     if configure_env:
       config_str = ' '.join([key + '=' + pipes.quote(configure_env[key]) for key in configure_env])
-      self.writer.variable('configure_env', config_str + '$ ')
+      headerwriter.variable('configure_env', config_str + '$ ')
 
     if variables is None:
       variables = {}
@@ -96,21 +241,68 @@ class Generator(object):
       variables['coverage'] = True
     if options.lto:
       variables['lto'] = True
-    if self.subninja != '':
+    if options.specializerules:
+      variables['specialize_rules'] = True
+    if options.unity:
+      variables['unity'] = True
+    if options.jobs > 1:
+      variables['jobs'] = options.jobs
+    if options.only:
+      variables['only'] = ','.join(options.only)
+    if options.default:
+      variables['default'] = ','.join(options.default)
+    if self.subninja != '' or options.workspace:
       variables['internal_deps'] = True
 
-    self.toolchain = toolchain.make_toolchain(self.host, self.target, options.toolchain)
-    self.toolchain.buildprefs = options.buildprefs
     self.toolchain.initialize(project, archs, configs, includepaths, dependlibs, libpaths, variables, self.subninja)
 
-    self.writer.variable('configure_toolchain', self.toolchain.name())
-    self.writer.variable('configure_archs', archs)
-    self.writer.variable('configure_configs', configs)
-    self.writer.newline()
+    headerwriter.variable('configure_toolchain', self.toolchain.name())
+    headerwriter.variable('configure_archs', archs)
+    headerwriter.variable('configure_configs', configs)
+    headerwriter.newline()
 
-    self.toolchain.write_variables(self.writer)
+    self.toolchain.write_variables(headerwriter)
     if self.subninja == '':
-      self.toolchain.write_rules(self.writer)
+      self.toolchain.write_rules(headerwriter)
+      self.write_configure_rule(headerwriter)
+      if options.workspace:
+        self.generate_workspace(options)
+    #The version edge goes with the rules, which every partition entry point includes
+    self.toolchain.write_version(headerwriter)
+
+    if commandline:
+      self.script = main_frame()
+      atexit.register(self.exit)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    #Write the build files when the block completes or exits with a success status
+    if exc_type is None or (exc_type is SystemExit and exc_value.code in [None, 0]):
+      self.close()
+    else:
+      self.discard()
+    return False
+
+  def exit(self):
+    #Exit handler closing a generator created from the command line. Exit handlers can not
+    #query the exit status, so the previous build files are kept unless the configure script
+    #ran to completion. Scripts exiting early with sys.exit close the generator first
+    if self.closed:
+      return
+    if not completed(self.script):
+      self.discard()
+      sys.stderr.write('Configure did not complete, keeping the previous build files\n')
+      return
+    try:
+      self.close()
+    except Exception:
+      #Exceptions in exit handlers are ignored, so exit with a failure status directly
+      traceback.print_exc()
+      sys.stdout.flush()
+      sys.stderr.flush()
+      os._exit(1)
 
   def target(self):
     return self.target
@@ -124,9 +316,215 @@ class Generator(object):
   def writer(self):
     return self.writer
 
+  def open_writer(self, filename):
+    if self.compact:
+      writer = graph.Graph(width = 0)
+    else:
+      writer = graph.Graph()
+    if not self.keep_graphs:
+      writer.stream(syntax.Writer(open(self.staging_file(filename), 'w'), width = writer.width))
+    self.writers += [(writer, filename)]
+    return writer
+
+  def staging_file(self, filename):
+    path = os.path.dirname(filename)
+    if path != '' and not os.path.isdir(path):
+      os.makedirs(path)
+    return filename + '.tmp'
+
+  def slice_writer(self, config, arch):
+    key = (config, arch)
+    if key in self.slice_writers:
+      return self.slice_writers[key]
+    slicefile = os.path.join(self.toolchain.buildpath, config, arch, 'build.ninja')
+    writer = self.open_writer(slicefile)
+    self.writer.subninja(slicefile)
+    if self.subninja == '':
+      #Standalone entry point parsing only the rules and this slice, usable with ninja -f
+      entrywriter = self.open_writer(os.path.join(self.toolchain.buildpath, 'build-' + config + '-' + arch + '.ninja'))
+      entrywriter.include(self.rulesfile)
+      entrywriter.include(slicefile)
+    self.slice_writers[key] = writer
+    return writer
+
+  def generate_workspace(self, options):
+    #Run the configure script of each dependent lib as a subninja of this build, all in
+    #parallel. Rules and pools are only written by this build and shared by the libs
+    args = ['--target', self.target.platform, '--host', self.host.platform, '--toolchain', self.toolchain.name()]
+    for config in options.config:
+      args += ['--config', config]
+    for arch in options.arch:
+      args += ['--arch', arch]
+    for flag in ['coverage', 'lto', 'compact', 'specializerules', 'unity']:
+      if getattr(options, flag):
+        args += ['--' + flag]
+    if options.buildprefs != '':
+      args += ['--buildprefs', options.buildprefs]
+    if options.variant != '':
+      args += ['--variant', options.variant]
+    processes = []
+    for lib, path in self.toolchain.depend_paths.items():
+      script = os.path.join(path, 'configure.py')
+      if not os.path.isfile(script):
+        continue
+      buildfile = os.path.join(self.toolchain.buildpath, 'workspace', lib + '.ninja')
+      command = [sys.executable, script, '--subninja', path, '--buildfile', buildfile] + args
+      processes += [(lib, buildfile, subprocess.Popen(command))]
+      self.configure_depend(script)
+    for lib, buildfile, process in processes:
+      if process.wait() != 0:
+        raise Exception('Unable to generate workspace lib ' + lib + ', configure exited with code ' + str(process.returncode))
+      self.writer.subninja(buildfile)
+      self.workspace_files += [buildfile]
+    if processes:
+      self.writer.newline()
+
+  def configure_depend(self, path):
+    """Record a file read by configure, rerunning configure when it changes"""
+    if path not in self.configure_depends:
+      self.configure_depends += [path]
+
+  def generator_modules(self):
+    #Generator modules loaded by this run, as paths relative to the working directory
+    generatorpath = os.path.dirname(os.path.abspath(__file__))
+    modules = []
+    for module in list(sys.modules.values()):
+      filename = getattr(module, '__file__', None)
+      if filename and os.path.dirname(os.path.abspath(filename)) == generatorpath:
+        modules += [os.path.relpath(os.path.abspath(filename))]
+    return sorted(modules)
+
+  def write_configure_rule(self, writer):
+    writer.rule('configure', command = '${configure_env}' + self.toolchain.python + ' ' + self.configure_depends[0] + ' $configure_args',
+                depfile = self.configure_depfile, generator = True, restat = True, description = 'CONFIGURE $out')
+    writer.newline()
+
+  def write_configure(self):
+    #Every file read by configure goes into the depfile of the edge regenerating the build files
+    outputs = [filename for _, filename in self.writers] + self.workspace_files
+    #Sources written by configure are recreated if missing
+    outputs += list(collections.OrderedDict.fromkeys(self.toolchain.generated_files))
+    #Globbed directories are included so adding or removing files reruns configure
+    depends = self.configure_depends + self.toolchain.build_prefs_files() + self.generator_modules() + list(self.directories.scanned)
+    depends = [path for path in collections.OrderedDict.fromkeys(depends) if os.path.exists(path)]
+    self.writer.newline()
+    self.writer.build(outputs, 'configure')
+    escape = lambda path: path.replace('\\', '/').replace(' ', '\\ ')
+    tmpfile = self.configure_depfile + '.tmp'
+    with open(tmpfile, 'w') as depfile:
+      depfile.write(escape(outputs[0]) + ': ' + ' \\\n  '.join([escape(path) for path in depends]) + '\n')
+    replace_if_changed(tmpfile, self.configure_depfile)
+
+  def release(self):
+    self.closed = True
+    self.toolchain.close_pool()
+    if not self.shared_probes:
+      self.toolchain.probes.save()
+    self.directories.save()
+
+  def discard(self):
+    """Close the generator without writing the build files, keeping the previous ones"""
+    if self.closed:
+      return
+    self.release()
+    for buildgraph, filename in self.writers:
+      if buildgraph.output is not None:
+        buildgraph.output.close()
+        os.remove(filename + '.tmp')
+
+  def close(self):
+    """Write the build files. Errors writing them are raised"""
+    if self.closed:
+      return
+    self.release()
+    self.toolchain.write_aliases(self.writer)
+    if self.subninja == '':
+      path = os.path.dirname(self.configure_depfile)
+      if path != '' and not os.path.isdir(path):
+        os.makedirs(path)
+      self.write_configure()
+    for buildgraph, filename in self.writers:
+      if buildgraph.output is not None:
+        buildgraph.flush()
+        buildgraph.output.close()
+      else:
+        writer = syntax.Writer(open(self.staging_file(filename), 'w'), width = buildgraph.width)
+        buildgraph.deduplicate()
+        buildgraph.write(writer)
+        writer.close()
+      replace_if_changed(filename + '.tmp', filename)
+    if self.affected_files:
+      self.print_affected(self.affected_files)
+    if self.watch:
+      watch.WatchSession(self).run()
+
+  def ninja_command(self, ninja = 'ninja'):
+    if self.buildfile != 'build.ninja':
+      return [ninja, '-f', self.buildfile]
+    return [ninja]
+
+  def graph_index(self, ninja = 'ninja'):
+    """Index of the generated graph, including the header dependencies recorded in the
+    ninja deps log by previous builds"""
+    index = graph.GraphIndex([buildgraph for buildgraph, _ in self.writers])
+    try:
+      deps = subprocess.run(self.ninja_command(ninja) + ['-t', 'deps'], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).stdout.decode()
+      index.add_deps(graph.parse_deps(deps))
+    except OSError:
+      pass
+    return index
+
+  def affected(self, changed, index = None):
+    """Targets to build and test binaries to run for a list of changed files, as a dict
+    with 'targets', 'tests' and 'full'. When full is set, the change can not be narrowed
+    down and everything is to be built and tested. Changed files unknown to the graph,
+    like documentation, affect nothing"""
+    if index is None:
+      index = self.graph_index()
+    changed = [os.path.normpath(os.path.relpath(path) if os.path.isabs(path) else path) for path in changed]
+    configure_inputs = self.configure_depends + self.toolchain.build_prefs_files() + self.generator_modules() + list(self.directories.scanned)
+    configure_inputs = set([os.path.normpath(path) for path in configure_inputs])
+    headers = ['.h', '.hh', '.hpp', '.hxx', '.inl', '.inc']
+    full = False
+    for path in changed:
+      if path in configure_inputs or os.path.normpath(os.path.dirname(path)) in configure_inputs:
+        full = True
+      elif path not in index.consumers and not index.deps and os.path.splitext(path)[1] in headers:
+        #Without a deps log there is no record of which objects include a header
+        full = True
+    tests = [test for test in self.test_binaries()]
+    if full:
+      return {'targets': index.defaults(), 'tests': tests, 'full': True}
+    affected = set()
+    for edge in index.affected_edges(changed):
+      affected.update(index.edges[edge][1])
+    tests = [test for test in tests if os.path.normpath(test) in affected]
+    return {'targets': index.targets(changed), 'tests': tests, 'full': False}
+
+  def print_affected(self, changed):
+    files = []
+    for path in changed:
+      if path == '-':
+        files += [line.strip() for line in sys.stdin if line.strip()]
+      else:
+        files += [path]
+    print(json.dumps(self.affected(files), indent = 2))
+
   def is_subninja(self):
     return self.subninja != ''
 
+  def glob_sources(self, module, patterns = None, basepath = None, recursive = False, exclude = None):
+    """Source files in the module directory matching the given patterns, by default all C,
+    C++ and Objective-C sources, as names relative to the module as taken by lib, sharedlib
+    and bin. Listings are cached, and adding or removing files in a scanned directory
+    reruns configure"""
+    if patterns is None:
+      patterns = ['*.c', '*.cpp', '*.cc', '*.m', '*.mm']
+    if basepath is None:
+      basepath = ''
+    path = os.path.join(self.subninja, basepath, module)
+    return self.directories.glob(path, self.writer._as_list(patterns), recursive, self.writer._as_list(exclude))
+
   def lib(self, module, sources, libname = None, basepath = None, configs = None, includepaths = None, variables = None):
     return self.toolchain.lib(self.writer, module, sources, libname, basepath, configs, includepaths, variables)
 
@@ -134,7 +532,24 @@ class Generator(object):
     return self.toolchain.sharedlib(self.writer, module, sources, libname, basepath, configs, includepaths, libpaths, implicit_deps, dependlibs, libs, frameworks, variables)
 
   def bin(self, module, sources, binname, basepath = None, configs = None, includepaths = None, libpaths = None, implicit_deps = None, dependlibs = None, libs = None, frameworks = None, variables = None):
-    return self.toolchain.bin(self.writer, module, sources, binname, basepath, configs, includepaths, libpaths, implicit_deps, dependlibs, libs, frameworks, variables)
+    built = self.toolchain.bin(self.writer, module, sources, binname, basepath, configs, includepaths, libpaths, implicit_deps, dependlibs, libs, frameworks, variables)
+    self.binaries += [(module, basepath, binname, built)]
+    return built
+
+  def is_test_binary(self, module, basepath, binname):
+    #Test binaries are declared below the test directory, like test/<case> built as test-<case>,
+    #or as a module named test
+    basepath = os.path.normpath(basepath or '').replace('\\', '/').split('/')
+    return module == 'test' or basepath[0] == 'test' or binname == 'test' or binname.startswith('test-')
+
+  def test_binaries(self):
+    """Output paths of the binaries built for the test cases"""
+    tests = []
+    for module, basepath, binname, built in self.binaries:
+      if self.is_test_binary(module, basepath, binname) and not isinstance(built, toolchain.DeferredOutputs):
+        for config in built:
+          tests += built[config]
+    return tests
 
   def app(self, module, sources, binname, basepath = None, configs = None, includepaths = None, libpaths = None, implicit_deps = None, dependlibs = None, libs = None, frameworks = None, variables = None, resources = None):
     return self.toolchain.app(self.writer, module, sources, binname, basepath, configs, includepaths, libpaths, implicit_deps, dependlibs, libs, frameworks, variables, resources)
@@ -150,3 +565,57 @@ class Generator(object):
 
   def test_monolithic(self):
     return self.toolchain.is_monolithic()
+
+#Arguments used by forked variant generation workers
+pool_arguments = None
+
+def generate_variant_task(index):
+  project, variants, configure, includepaths, dependlibs, libpaths, variables, probes = pool_arguments
+  buildfile = generate_variant(project, variants[index], configure, includepaths, dependlibs, libpaths, variables, probes)
+  return buildfile, probes.entries
+
+def generate_variant(project, variant, configure, includepaths, dependlibs, libpaths, variables, probes):
+  generator = Generator(project, list(includepaths or []), list(dependlibs or []), list(libpaths or []), dict(variables or {}), options = variant, probes = probes)
+  try:
+    if configure is not None:
+      configure(generator)
+  except:
+    generator.discard()
+    raise
+  generator.close()
+  return generator.buildfile
+
+def generate_variants(project, variants, configure = None, includepaths = None, dependlibs = None, libpaths = None, variables = None, jobs = 1):
+  """Generate build files for several variants in one process, returning the build
+  file names. Each variant is a dict of generator options as taken by make_options,
+  and should name its own buildfile, plus a variant name when targets are repeated.
+  configure is called with the Generator of each variant to declare its modules.
+  Toolchain probes are shared by all variants, and with jobs > 1 variants are
+  generated in parallel by forked worker processes"""
+  import probe
+  prefsfiles = ['build.json', os.path.join('build', 'ninja', 'build.json')]
+  prefsfiles += [variant['buildprefs'] for variant in variants if variant.get('buildprefs')]
+  probes = probe.ProbeCache(os.path.join('build', 'ninja', 'probes.json'), lambda: prefsfiles)
+  probes.load()
+  buildfiles = []
+  context = None
+  if jobs > 1 and len(variants) > 1:
+    import multiprocessing
+    try:
+      context = multiprocessing.get_context('fork')
+    except ValueError:
+      context = None
+  if context is None:
+    for variant in variants:
+      buildfiles += [generate_variant(project, variant, configure, includepaths, dependlibs, libpaths, variables, probes)]
+  else:
+    from concurrent.futures import ProcessPoolExecutor
+    global pool_arguments
+    pool_arguments = (project, variants, configure, includepaths, dependlibs, libpaths, variables, probes)
+    with ProcessPoolExecutor(max_workers = jobs, mp_context = context) as executor:
+      for buildfile, entries in executor.map(generate_variant_task, range(len(variants))):
+        buildfiles += [buildfile]
+        probes.merge(entries)
+    pool_arguments = None
+  probes.save()
+  return buildfiles
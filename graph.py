@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""Ninja build graph
+
+In-memory representation of a ninja build file. Graph has the same statement
+interface as syntax.Writer so toolchain builders can target either, and the
+recorded graph is serialized through a syntax.Writer in one pass, or streamed
+to one as finished parts are appended. Paths and variable values are interned,
+so the flags and path prefixes repeated across edges are only stored once.
+"""
+
+import os
+import re
+import sys
+
+def as_list(input):
+  if input is None:
+    return []
+  if isinstance(input, list):
+    return input
+  if isinstance(input, tuple):
+    return list(input)
+  return [input]
+
+def intern_paths(paths):
+  #A single path is stored as the string itself rather than a one element tuple
+  paths = as_list(paths)
+  if len(paths) == 1:
+    return sys.intern(paths[0])
+  return tuple([sys.intern(path) for path in paths])
+
+def intern_value(value):
+  if isinstance(value, list):
+    value = ' '.join(filter(None, value))
+  if isinstance(value, str):
+    return sys.intern(value)
+  return value
+
+class Rule(object):
+  __slots__ = ('name', 'command', 'description', 'depfile', 'generator', 'pool', 'restat', 'rspfile', 'rspfile_content', 'deps')
+
+  def __init__(self, name, command, description, depfile, generator, pool, restat, rspfile, rspfile_content, deps):
+    self.name = name
+    self.command = command
+    self.description = description
+    self.depfile = depfile
+    self.generator = generator
+    self.pool = pool
+    self.restat = restat
+    self.rspfile = rspfile
+    self.rspfile_content = rspfile_content
+    self.deps = deps
+
+class Edge(object):
+  __slots__ = ('outputs', 'rule', 'inputs', 'implicit', 'order_only', 'variables')
+
+  def __init__(self, outputs, rule, inputs, implicit, order_only, variables):
+    self.outputs = outputs
+    self.rule = rule
+    self.inputs = inputs
+    self.implicit = implicit
+    self.order_only = order_only
+    self.variables = variables
+
+  def key(self):
+    return (self.outputs, self.rule, self.inputs, self.implicit, self.order_only, self.variables)
+
+#Statement kinds other than rules and edges, stored as tuples led by the kind
+VARIABLE = 0
+POOL = 1
+COMMENT = 2
+NEWLINE = 3
+INCLUDE = 4
+SUBNINJA = 5
+DEFAULT = 6
+
+class Graph(object):
+  def __init__(self, width = 78):
+    self.width = width
+    self.statements = []
+    self.variablesets = {}
+    #Writer flushed statements go to when streaming
+    self.output = None
+    #Uses of noted directory prefixes by edge paths, counted as edges are added
+    self.prefixes = {}
+    self.prefix_order = []
+    self.prefix_heads = ()
+
+  def newline(self):
+    self.statements.append((NEWLINE,))
+
+  def comment(self, text):
+    self.statements.append((COMMENT, text))
+
+  def variable(self, key, value, indent = 0):
+    if value is None:
+      return
+    self.statements.append((VARIABLE, key, intern_value(value), indent))
+
+  def define(self, key, value):
+    """Define a variable ahead of all statements recorded so far"""
+    self.statements.insert(0, (VARIABLE, key, intern_value(value), 0))
+
+  def pool(self, name, depth):
+    self.statements.append((POOL, name, depth))
+
+  def rule(self, name, command, description = None, depfile = None,
+           generator = False, pool = None, restat = False, rspfile = None,
+           rspfile_content = None, deps = None):
+    self.statements.append(Rule(name, command, description, depfile, generator, pool, restat, rspfile, rspfile_content, deps))
+
+  def build(self, outputs, rule, inputs = None, implicit = None, order_only = None,
+            variables = None):
+    edgevariables = ()
+    if variables:
+      if isinstance(variables, dict):
+        iterator = iter(variables.items())
+      else:
+        iterator = iter(variables)
+      edgevariables = tuple([(key, intern_value(val)) for key, val in iterator if val is not None])
+      edgevariables = self.variablesets.setdefault(edgevariables, edgevariables)
+    edge = Edge(intern_paths(outputs), rule, intern_paths(inputs), intern_paths(implicit), intern_paths(order_only), edgevariables)
+    self.statements.append(edge)
+    if self.prefixes:
+      self.count_prefixes(edge)
+    return as_list(edge.outputs)
+
+  def include(self, path):
+    self.statements.append((INCLUDE, path))
+
+  def subninja(self, path):
+    self.statements.append((SUBNINJA, path))
+
+  def default(self, paths):
+    self.statements.append((DEFAULT, intern_paths(paths)))
+
+  def append(self, other):
+    """Append the statements of another graph, writing them out when streaming"""
+    self.statements.extend(other.statements)
+    self.flush()
+
+  def stream(self, writer):
+    """Write statements through the given syntax.Writer as they are flushed instead of
+    keeping them, so finished parts of the graph are released"""
+    self.output = writer
+    self.flush()
+
+  def flush(self):
+    """Write and release the statements recorded so far when streaming. Edges identical
+    to an earlier edge in the same flush, like those of a source listed twice in a
+    module, are dropped"""
+    if self.output is None:
+      return
+    self.deduplicate()
+    statements = self.statements
+    self.statements = []
+    for statement in statements:
+      write_statement(self.output, statement)
+
+  def _as_list(self, input):
+    return as_list(input)
+
+  def edges(self):
+    return [statement for statement in self.statements if isinstance(statement, Edge)]
+
+  def rules(self):
+    return [statement for statement in self.statements if isinstance(statement, Rule)]
+
+  def note_prefix(self, prefix):
+    """Count the edge paths below the given directory prefix in edges added from now on,
+    each path counting for the longest noted prefix it is below"""
+    if prefix in self.prefixes:
+      return
+    self.prefixes[prefix] = 0
+    self.prefix_order = sorted([(prefix, (prefix + '/', prefix + os.sep)) for prefix in self.prefixes], key = lambda item: len(item[0]), reverse = True)
+    self.prefix_heads = tuple([head for _, heads in self.prefix_order for head in heads])
+
+  def count_prefixes(self, edge):
+    allheads = self.prefix_heads
+    for paths in (edge.outputs, edge.inputs, edge.implicit, edge.order_only):
+      for path in ((paths,) if isinstance(paths, str) else paths):
+        if path.startswith(allheads):
+          for prefix, heads in self.prefix_order:
+            if path.startswith(heads):
+              self.prefixes[prefix] += 1
+              break
+
+  def prefix_uses(self):
+    """Dictionary of the noted prefixes to the number of edge paths below them"""
+    return dict(self.prefixes)
+
+  def replace_prefixes(self, replacements):
+    """Replace the directory prefix of edge paths below any of the prefixes in the given
+    dictionary of prefix to replacement, the longest matching prefix first"""
+    order = sorted([(prefix, (prefix + '/', prefix + os.sep), replacement) for prefix, replacement in replacements.items()], key = lambda item: len(item[0]), reverse = True)
+    allheads = tuple([head for _, heads, _ in order for head in heads])
+    if not allheads:
+      return
+    def replace(path):
+      for prefix, heads, replacement in order:
+        if path.startswith(heads):
+          return sys.intern(replacement + path[len(prefix):])
+      return path
+    def replace_paths(paths):
+      if isinstance(paths, str):
+        return replace(paths) if paths.startswith(allheads) else paths
+      if any(path.startswith(allheads) for path in paths):
+        return tuple([replace(path) for path in paths])
+      return paths
+    for statement in self.statements:
+      if isinstance(statement, Edge):
+        statement.outputs = replace_paths(statement.outputs)
+        statement.inputs = replace_paths(statement.inputs)
+        statement.implicit = replace_paths(statement.implicit)
+        statement.order_only = replace_paths(statement.order_only)
+    self.prefixes = {}
+    self.prefix_order = []
+    self.prefix_heads = ()
+
+  def deduplicate(self):
+    """Drop edges identical to an earlier edge, returning the number removed"""
+    seen = set()
+    statements = []
+    for statement in self.statements:
+      if isinstance(statement, Edge):
+        key = statement.key()
+        if key in seen:
+          continue
+        seen.add(key)
+      statements.append(statement)
+    removed = len(self.statements) - len(statements)
+    self.statements = statements
+    return removed
+
+  def write(self, writer):
+    """Serialize all statements through the given syntax.Writer"""
+    for statement in self.statements:
+      write_statement(writer, statement)
+
+def write_statement(writer, statement):
+  if isinstance(statement, Edge):
+    writer.build(statement.outputs, statement.rule, statement.inputs, implicit = statement.implicit, order_only = statement.order_only, variables = statement.variables)
+  elif isinstance(statement, Rule):
+    writer.rule(statement.name, statement.command, description = statement.description, depfile = statement.depfile,
+                generator = statement.generator, pool = statement.pool, restat = statement.restat, rspfile = statement.rspfile,
+                rspfile_content = statement.rspfile_content, deps = statement.deps)
+  else:
+    kind = statement[0]
+    if kind == VARIABLE:
+      writer.variable(statement[1], statement[2], indent = statement[3])
+    elif kind == NEWLINE:
+      writer.newline()
+    elif kind == COMMENT:
+      writer.comment(statement[1])
+    elif kind == POOL:
+      writer.pool(statement[1], statement[2])
+    elif kind == INCLUDE:
+      writer.include(statement[1])
+    elif kind == SUBNINJA:
+      writer.subninja(statement[1])
+    elif kind == DEFAULT:
+      writer.default(as_list(statement[1]))
+
+escaped = re.compile(r'\$(\$|:| |\{([a-zA-Z0-9_.-]+)\}|([a-zA-Z0-9_-]+))')
+
+def expand(value, variables):
+  """Expand variable references and escapes in a ninja string"""
+  def substitute(match):
+    name = match.group(2) or match.group(3)
+    if name is not None:
+      return variables.get(name, '')
+    return match.group(1)
+  return escaped.sub(substitute, value)
+
+def parse_deps(text):
+  """Parse the output of ninja -t deps into a dict of output to the list of its dependencies"""
+  deps = {}
+  current = None
+  for line in text.splitlines():
+    if not line.strip():
+      current = None
+    elif line[0].isspace():
+      if current is not None:
+        current += [line.strip()]
+    else:
+      current = deps.setdefault(line.split(': #deps')[0], [])
+  return deps
+
+class GraphIndex(object):
+  """Lookup of the edges producing and consuming each path in a set of graphs, with
+  paths expanded and normalized. Order-only inputs do not trigger rebuilds and are
+  left out, as are phony aliases which build nothing themselves"""
+  def __init__(self, graphs):
+    self.variables = {}
+    self.edges = []
+    self.producers = {}
+    self.consumers = {}
+    self.deps = False
+    for buildgraph in graphs:
+      for statement in buildgraph.statements:
+        if isinstance(statement, Edge):
+          if statement.rule != 'phony':
+            self.add_edge(statement)
+        elif isinstance(statement, tuple) and statement[0] == VARIABLE and statement[3] == 0:
+          self.variables[statement[1]] = expand(str(statement[2]), self.variables)
+
+  def path(self, path):
+    return os.path.normpath(expand(path, self.variables))
+
+  def add_edge(self, edge):
+    outputs = tuple([self.path(path) for path in as_list(edge.outputs)])
+    inputs = tuple([self.path(path) for path in as_list(edge.inputs) + as_list(edge.implicit)])
+    index = len(self.edges)
+    self.edges.append((edge.rule, outputs, inputs))
+    for path in outputs:
+      self.producers[path] = index
+    for path in inputs:
+      self.consumers.setdefault(path, []).append(index)
+
+  def add_deps(self, deps):
+    """Add dependencies discovered by the build, as returned by parse_deps"""
+    if deps:
+      self.deps = True
+    for output, paths in deps.items():
+      index = self.producers.get(os.path.normpath(output))
+      if index is None:
+        continue
+      for path in paths:
+        path = os.path.normpath(path)
+        consumers = self.consumers.setdefault(path, [])
+        if index not in consumers:
+          consumers.append(index)
+
+  def sources(self):
+    """Input files not produced by any edge"""
+    return [path for path in self.consumers if path not in self.producers]
+
+  def defaults(self):
+    """Outputs not consumed by any edge, which ninja builds by default"""
+    return [path for _, outputs, _ in self.edges for path in outputs if path not in self.consumers]
+
+  def affected_edges(self, changed):
+    affected = set()
+    pending = [os.path.normpath(path) for path in changed]
+    while pending:
+      path = pending.pop()
+      for index in self.consumers.get(path, []):
+        if index not in affected:
+          affected.add(index)
+          pending += self.edges[index][1]
+    return affected
+
+  def targets(self, changed):
+    """Smallest set of outputs whose build covers every edge affected by the changed files"""
+    affected = self.affected_edges(changed)
+    targets = []
+    for index in sorted(affected):
+      outputs = self.edges[index][1]
+      if not any(consumer in affected for path in outputs for consumer in self.consumers.get(path, [])):
+        targets += [outputs[0]]
+    return targets
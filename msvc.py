@@ -23,8 +23,8 @@ class MSVCToolchain(toolchain.Toolchain):
     self.dller = 'dll'
 
     #Command definitions (to generate assembly, add "/FAs /Fa$out.asm")
-    self.cccmd = '$toolchain$cc /showIncludes /I. $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags /c $in /Fo$out /Fd$pdbpath /FS /nologo'
-    self.cxxcmd = '$toolchain$cxx /showIncludes /I. $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags /c $in /Fo$out /Fd$pdbpath /FS /nologo'
+    self.cccmd = '$launcher$toolchain$cc /showIncludes /I. $includepaths $moreincludepaths $cflags $carchflags $cconfigflags $cmoreflags $pchflags /c $in /Fo$out /Fd$pdbpath /FS /nologo'
+    self.cxxcmd = '$launcher$toolchain$cxx /showIncludes /I. $includepaths $moreincludepaths $cxxflags $carchflags $cconfigflags $cmoreflags $pchflags /c $in /Fo$out /Fd$pdbpath /FS /nologo'
     self.ccdepfile = None
     self.ccdeps = 'msvc'
     self.arcmd = '$toolchain$ar $arflags $ararchflags $arconfigflags /NOLOGO /OUT:$out $in'
@@ -119,16 +119,26 @@ class MSVCToolchain(toolchain.Toolchain):
 
   def write_rules(self, writer):
     super(MSVCToolchain, self).write_rules(writer)
-    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CC $in')
-    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, description = 'CXX $in')
-    writer.rule('ar', command = self.arcmd, description = 'LIB $out')
-    writer.rule('link', command = self.linkcmd, description = 'LINK $out')
-    writer.rule('dll', command = self.dllcmd, description = 'DLL $out')
+    writer.rule('cc', command = self.cccmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CC $in')
+    writer.rule('cxx', command = self.cxxcmd, depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'CXX $in')
+    writer.rule('ccpch', command = self.pchcmd(self.cccmd, '/Tc'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+    writer.rule('cxxpch', command = self.pchcmd(self.cxxcmd, '/Tp'), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = 'PCH $in')
+    writer.rule('ar', command = self.arcmd, pool = self.link_pool(), description = 'LIB $out')
+    writer.rule('link', command = self.linkcmd, pool = self.link_pool(), description = 'LINK $out')
+    writer.rule('dll', command = self.dllcmd, pool = self.link_pool(), description = 'DLL $out')
     writer.newline()
 
+  def vs_registry_depends(self):
+    #Visual Studio setup registers each installed instance in this directory
+    return [os.path.join(os.environ.get('ProgramData', 'C:\\ProgramData'), 'Microsoft', 'VisualStudio', 'Packages', '_Instances')]
+
+  def sdk_registry_depends(self):
+    programfiles = os.environ.get('ProgramFiles(x86)', 'C:\\Program Files (x86)')
+    return [os.path.join(programfiles, 'Windows Kits', '10', 'Include'), os.path.join(programfiles, 'Windows Kits', '8.1', 'Include')]
+
   def build_toolchain(self):
     if self.toolchain == '':
-      installed_versions = vslocate.get_vs_installations()
+      installed_versions = self.probes.call('vslocate', vslocate.get_vs_installations, self.vs_registry_depends())
       for versionstr, installpath in installed_versions:
         major_version = versionstr.split('.')[0]
         if int(major_version) >= 15:
@@ -153,10 +163,11 @@ class MSVCToolchain(toolchain.Toolchain):
           'HKLM\\SOFTWARE\\Wow6432Node\\Microsoft\\VisualStudio\\SxS\\VS7',
           'HKCU\\SOFTWARE\\Wow6432Node\\Microsoft\\VisualStudio\\SxS\\VS7'
         ]
+        self.probes.prefetch([['reg', 'query', key, '/v', version] for version in versions for key in keys], self.vs_registry_depends())
         for version in versions:
           for key in keys:
             try:
-              query = subprocess.check_output(['reg', 'query', key, '/v', version ], stderr = subprocess.STDOUT).strip().splitlines()
+              query = self.probes.check_output(['reg', 'query', key, '/v', version], self.vs_registry_depends()).splitlines()
               if len(query) == 2:
                 toolchain = str(query[1]).split('REG_SZ')[-1].strip(" '\"\n\r\t")
             except:
@@ -184,17 +195,18 @@ class MSVCToolchain(toolchain.Toolchain):
         'HKCU\\SOFTWARE\\Wow6432Node\\Microsoft\\Microsoft SDKs\\Windows'
       ]
       include_path = 'include'
+      self.probes.prefetch([['reg', 'query', key + '\\' + version, '/v', value] for version in versions for key in keys for value in ['InstallationFolder', 'ProductVersion'] if value == 'InstallationFolder' or version == 'v10.0'], self.sdk_registry_depends())
       for version in versions:
         for key in keys:
           sdkpath = ''
           try:
-            query = subprocess.check_output(['reg', 'query', key + '\\' + version, '/v', 'InstallationFolder'], stderr = subprocess.STDOUT).strip().splitlines()
+            query = self.probes.check_output(['reg', 'query', key + '\\' + version, '/v', 'InstallationFolder'], self.sdk_registry_depends()).splitlines()
             if len(query) == 2:
               sdkpath = str(query[1]).split('REG_SZ')[-1].strip(" '\"\n\r\t")
               if not sdkpath == '' and version == 'v10.0':
                 base_path = sdkpath
                 sdkpath = ''
-                query = subprocess.check_output(['reg', 'query', key + '\\' + version, '/v', 'ProductVersion'], stderr = subprocess.STDOUT).strip().splitlines()
+                query = self.probes.check_output(['reg', 'query', key + '\\' + version, '/v', 'ProductVersion'], self.sdk_registry_depends()).splitlines()
                 if len(query) == 2:
                   version_path = str(query[1]).split('REG_SZ')[-1].strip(" '\"\n\r\t")
                   if not version_path == '':
@@ -306,6 +318,7 @@ class MSVCToolchain(toolchain.Toolchain):
       return [lib + '.lib' for lib in libs]
     return []
 
+  @toolchain.memoize
   def make_configlibpaths(self, config, arch, extralibpaths):
     libpaths = [
       self.libpath,
@@ -354,6 +367,8 @@ class MSVCToolchain(toolchain.Toolchain):
       for define in variables['defines']:
         definelist += ['/D', '"' + define + '"']
       localvariables += [('cmoreflags', definelist)]
+    if 'pchflags' in variables:
+      localvariables += [('pchflags', variables['pchflags'])]
     return localvariables
 
   def ar_variables(self, config, arch, targettype, variables):
@@ -386,11 +401,33 @@ class MSVCToolchain(toolchain.Toolchain):
     localvariables += [('configlibpaths', self.make_configlibpaths(config, arch, libpaths))]
     return localvariables
 
+  def pchcmd(self, command, language):
+    #The header is compiled as a source forcibly including itself, creating the precompiled
+    #header at the point of that include
+    return command.replace('/c $in /Fo$out', '/c ' + language + '$in /Fo$out /Fp$pchfile /Yc$pchheader /FI$pchheader')
+
+  def precompile_header(self, writer, config, arch, targettype, kind, header, modulepath, variables):
+    #The object is the only declared output, as ninja keeps no deps log for edges with more,
+    #and must be linked with the module objects
+    if kind != 'c' and kind != 'cpp':
+      return None
+    rule = {'c': 'cc', 'cpp': 'cxx'}[kind]
+    command = {'c': self.cccmd, 'cpp': self.cxxcmd}[kind]
+    language = {'c': '/Tc', 'cpp': '/Tp'}[kind]
+    basename = os.path.join(modulepath, 'pch', os.path.splitext(os.path.basename(header))[0] + '-' + kind)
+    pchfile = basename + '.pch'
+    objfile = basename + self.objext
+    rule, localvariables = self.compile_rule(writer, rule + 'pch', self.pchcmd(command, language), 'PCH $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    writer.build(objfile, rule, header, implicit = self.implicit_deps(config, variables), variables = (localvariables or []) + [('pchfile', pchfile), ('pchheader', header)])
+    return [objfile], ['/Yu' + header, '/FI' + header, '/Fp' + pchfile], [objfile]
+
   def builder_cc(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cc', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cc', self.cccmd, 'CC $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_cxx(self, writer, config, arch, targettype, infile, outfile, variables):
-    return writer.build(outfile, 'cxx', infile, implicit = self.implicit_deps(config, variables), variables = self.cc_variables(config, arch, targettype, variables))
+    rule, localvariables = self.compile_rule(writer, 'cxx', self.cxxcmd, 'CXX $in', config, arch, self.cc_variables(config, arch, targettype, variables))
+    return writer.build(outfile, rule, infile, implicit = self.implicit_deps(config, variables), variables = localvariables)
 
   def builder_lib(self, writer, config, arch, targettype, infiles, outfile, variables):
     return writer.build(outfile, 'ar', infiles, implicit = self.implicit_deps(config, variables), variables = self.ar_variables(config, arch, targettype, variables))
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+"""Object cache utility
+
+Wraps a compile command, restoring the object file and depfile from a cache when
+the same source was compiled with the same flags and compiler before. The key is a
+hash of the preprocessed source, the compile arguments and a compiler fingerprint.
+Entries are stored in a local directory evicting the least recently used entries
+above a size limit, optionally backed by a shared cache over HTTP. Commands using a
+precompiled header are not cached, as the preprocessed source does not cover the
+header contents.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import zipfile
+
+try:
+  from urllib.request import Request, urlopen
+except ImportError:
+  from urllib2 import Request, urlopen
+
+#Bump to invalidate all entries written by an incompatible version
+cache_version = 1
+
+#Launchers the compile command may be prefixed with, the compiler follows them
+launchers = ['ccache', 'sccache', 'distcc', 'icecc']
+
+#Environment assignment preceding the compiler, as VAR=value
+environment_assignment = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+
+#Flags mapping absolute path prefixes in the output, as <flag>=<old>=<new>
+prefix_map_flags = ['-fdebug-prefix-map', '-fmacro-prefix-map', '-ffile-prefix-map']
+
+#Directories the local cache is split into, each evicted on its own
+bucket_count = 256
+
+class LocalBackend(object):
+  def __init__(self, path, max_size):
+    self.path = path
+    self.bucket_size = max(max_size // bucket_count, 1)
+
+  def entry_path(self, key):
+    return os.path.join(self.path, key[:2], key + '.zip')
+
+  def get(self, key):
+    path = self.entry_path(key)
+    try:
+      with open(path, 'rb') as entry:
+        data = entry.read()
+    except (IOError, OSError):
+      return None
+    try:
+      #Recently used entries are the last to be evicted
+      os.utime(path, None)
+    except OSError:
+      pass
+    return data
+
+  def put(self, key, data):
+    path = self.entry_path(key)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        pass
+    tmpfile = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpfile, 'wb') as entry:
+      entry.write(data)
+    os.replace(tmpfile, path)
+    self.evict(directory)
+
+  def evict(self, directory):
+    entries = []
+    size = 0
+    for name in os.listdir(directory):
+      if not name.endswith('.zip'):
+        continue
+      try:
+        stat = os.stat(os.path.join(directory, name))
+      except OSError:
+        continue
+      entries += [(stat.st_mtime, stat.st_size, name)]
+      size += stat.st_size
+    if size <= self.bucket_size:
+      return
+    #Evict down to a margin below the limit so every store does not evict again
+    for _, entrysize, name in sorted(entries):
+      try:
+        os.remove(os.path.join(directory, name))
+      except OSError:
+        continue
+      size -= entrysize
+      if size <= self.bucket_size * 0.9:
+        break
+
+class HTTPBackend(object):
+  """Shared cache reading entries with GET and storing them with PUT on <url>/<key>"""
+  def __init__(self, url, timeout = 10):
+    self.url = url.rstrip('/')
+    self.timeout = timeout
+
+  def get(self, key):
+    try:
+      response = urlopen(self.url + '/' + key, timeout = self.timeout)
+      return response.read()
+    except Exception:
+      return None
+
+  def put(self, key, data):
+    try:
+      request = Request(self.url + '/' + key, data = data)
+      request.get_method = lambda: 'PUT'
+      urlopen(request, timeout = self.timeout).read()
+    except Exception:
+      pass
+
+class ChainedBackend(object):
+  """Local cache in front of a shared one, keeping a local copy of shared hits"""
+  def __init__(self, local, shared):
+    self.local = local
+    self.shared = shared
+
+  def get(self, key):
+    data = self.local.get(key)
+    if data is None:
+      data = self.shared.get(key)
+      if data is not None:
+        self.local.put(key, data)
+    return data
+
+  def put(self, key, data):
+    self.local.put(key, data)
+    self.shared.put(key, data)
+
+#Shared backends by URL scheme
+backends = {
+  'http': HTTPBackend,
+  'https': HTTPBackend
+}
+
+def make_backend(options):
+  local = LocalBackend(options.dir, options.max_size)
+  if not options.backend:
+    return local
+  scheme = options.backend.split(':', 1)[0]
+  if not scheme in backends:
+    raise Exception('Unknown object cache backend: ' + options.backend)
+  return ChainedBackend(local, backends[scheme](options.backend))
+
+class CompileCommand(object):
+  """Compile command split into the compiler and the parts relevant to caching"""
+  def __init__(self, args):
+    self.args = list(args)
+    #Leading VAR=value assignments, like the PATH given to Xcode tools, are passed in the environment
+    self.environment = {}
+    self.launcher = []
+    while len(self.args) > 1 and (os.path.basename(self.args[0]) in launchers or environment_assignment.match(self.args[0])):
+      arg = self.args.pop(0)
+      if environment_assignment.match(arg):
+        key, val = arg.split('=', 1)
+        self.environment[key] = val
+      else:
+        self.launcher += [arg]
+    self.compiler = self.args[0] if self.args else None
+    self.output = None
+    self.depfile = None
+    self.sources = []
+    self.compiling = False
+    self.precompiled = False
+    self.prefix_maps = []
+    #Arguments for the key, without the output paths that differ between configs
+    self.keyargs = []
+    #Arguments preprocessing the source to standard output
+    self.preprocess = [self.compiler] if self.compiler else []
+    previous = None
+    args = iter(self.args[1:])
+    for arg in args:
+      if arg == '-o':
+        self.output = next(args, None)
+      elif arg == '-MF':
+        self.depfile = next(args, None)
+      elif arg == '-MT' or arg == '-MQ':
+        next(args, None)
+      elif arg in ['-MMD', '-MD']:
+        pass
+      elif arg == '-c':
+        self.compiling = True
+      elif arg.split('=', 1)[0] in prefix_map_flags and arg.count('=') >= 2:
+        #Only the mapped path is part of the key, so builds from different roots share entries
+        flag, old, new = arg.split('=', 2)
+        self.prefix_maps += [old]
+        self.keyargs += [flag + '=' + new]
+        self.preprocess += [arg]
+      else:
+        if arg in ['-include-pch', '-Winvalid-pch'] or (previous == '-x' and arg.endswith('-header')):
+          self.precompiled = True
+        if not arg.startswith('-') and not previous in ['-include', '-include-pch', '-isystem', '-I', '-D', '-U', '-x', '-arch', '-isysroot', '--sysroot', '-target', '-imacros']:
+          self.sources += [arg]
+        previous = arg
+        self.keyargs += [arg]
+        self.preprocess += [arg]
+    self.preprocess += ['-E']
+
+  def working_directory(self):
+    #The working directory is embedded in debug info unless it is mapped
+    cwd = os.getcwd()
+    for root in self.prefix_maps:
+      if cwd == root or cwd.startswith(root.rstrip(os.sep) + os.sep):
+        return ''
+    return cwd
+
+  def env(self):
+    #Environment for running the command, None to inherit the environment unchanged
+    if not self.environment:
+      return None
+    env = os.environ.copy()
+    env.update(self.environment)
+    return env
+
+  def command(self):
+    #Command line to run, without the environment assignments
+    return self.launcher + self.args
+
+  def cacheable(self):
+    return self.compiler is not None and self.compiling and not self.precompiled and self.output is not None and len(self.sources) == 1
+
+def compiler_fingerprint(compiler, environment = {}):
+  path = shutil.which(compiler, path = environment.get('PATH')) or compiler
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return [compiler]
+  return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+def strip_working_directory(preprocessed):
+  #gcc marks the working directory in preprocessed output, covered by the key already
+  for cwd in set([os.getcwd(), os.environ.get('PWD', '')]):
+    marker = ('# 1 "' + cwd + '//"\n').encode()
+    if cwd and marker in preprocessed[:4096]:
+      return preprocessed.replace(marker, b'', 1)
+  return preprocessed
+
+def make_key(command):
+  try:
+    process = subprocess.run(command.preprocess, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, env = command.env())
+  except OSError:
+    return None
+  if process.returncode != 0:
+    return None
+  digest = hashlib.sha256()
+  digest.update(json.dumps([cache_version, compiler_fingerprint(command.compiler, command.environment), command.environment, command.working_directory(), command.keyargs]).encode())
+  digest.update(strip_working_directory(process.stdout))
+  return digest.hexdigest()
+
+def read_file(path):
+  with open(path, 'rb') as file:
+    return file.read()
+
+def write_file(path, data):
+  directory = os.path.dirname(path)
+  if directory != '' and not os.path.isdir(directory):
+    os.makedirs(directory)
+  tmpfile = path + '.' + str(os.getpid()) + '.tmp'
+  with open(tmpfile, 'wb') as file:
+    file.write(data)
+  os.replace(tmpfile, path)
+
+def pack_entry(command, output):
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as entry:
+    entry.writestr('object', read_file(command.output))
+    if command.depfile and os.path.isfile(command.depfile):
+      #The target is the output path, restored as the output of the command hitting the entry
+      depends = read_file(command.depfile).decode(errors = 'replace')
+      entry.writestr('depends', depends.split(': ', 1)[-1])
+    entry.writestr('output', output)
+  return buffer.getvalue()
+
+def unpack_entry(command, data):
+  try:
+    with zipfile.ZipFile(io.BytesIO(data), 'r') as entry:
+      names = entry.namelist()
+      write_file(command.output, entry.read('object'))
+      if command.depfile:
+        if not 'depends' in names:
+          return None
+        depends = entry.read('depends').decode()
+        write_file(command.depfile, (command.output.replace(' ', '\\ ') + ': ' + depends).encode())
+      return entry.read('output') if 'output' in names else b''
+  except (zipfile.BadZipfile, KeyError, IOError, OSError):
+    return None
+
+def run_command(command):
+  process = subprocess.run(command.command(), stdout = subprocess.PIPE, stderr = subprocess.STDOUT, env = command.env())
+  return process.returncode, process.stdout
+
+def call_command(command):
+  return subprocess.call(command.command(), env = command.env())
+
+def compile(options, args):
+  command = CompileCommand(args)
+  if not command.cacheable() or os.environ.get('OBJCACHE_DISABLE'):
+    return call_command(command)
+  key = make_key(command)
+  if key is None:
+    #Let the compiler report the error
+    return call_command(command)
+  backend = make_backend(options)
+  data = backend.get(key)
+  if data is not None:
+    output = unpack_entry(command, data)
+    if output is not None:
+      sys.stdout.write(output.decode(errors = 'replace'))
+      return 0
+  returncode, output = run_command(command)
+  sys.stdout.write(output.decode(errors = 'replace'))
+  if returncode == 0 and os.path.isfile(command.output):
+    try:
+      backend.put(key, pack_entry(command, output))
+    except (IOError, OSError):
+      pass
+  return returncode
+
+def serve(options):
+  """Stand-in shared cache storing entries in the cache directory"""
+  try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+  except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  local = LocalBackend(options.dir, options.max_size)
+  class Handler(BaseHTTPRequestHandler):
+    def key(self):
+      key = self.path.strip('/')
+      if len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        self.send_error(400)
+        return None
+      return key
+    def do_GET(self):
+      key = self.key()
+      if key is None:
+        return
+      data = local.get(key)
+      if data is None:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+    def do_PUT(self):
+      key = self.key()
+      if key is None:
+        return
+      data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+      local.put(key, data)
+      self.send_response(201)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+    def log_message(self, format, *args):
+      pass
+  server = HTTPServer(('127.0.0.1', options.serve), Handler)
+  print('Serving object cache ' + options.dir + ' on http://127.0.0.1:' + str(server.server_port))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+def make_parser():
+  parser = argparse.ArgumentParser(description = 'Object cache utility for Ninja builds')
+  parser.add_argument('--dir', type=str,
+                      help = 'Local cache directory',
+                      default = os.path.join('build', 'ninja', 'objcache'))
+  parser.add_argument('--max-size', type=int,
+                      help = 'Local cache size limit in bytes',
+                      default = 2 * 1024 * 1024 * 1024)
+  parser.add_argument('--backend', type=str,
+                      help = 'Shared cache URL, like http://host:port',
+                      default = '')
+  parser.add_argument('--serve', type=int,
+                      help = 'Serve the local cache over HTTP on the given port as a shared cache',
+                      default = None)
+  parser.add_argument('command', nargs=argparse.REMAINDER,
+                      help = 'Compile command, after --')
+  return parser
+
+def main(args = None):
+  options = make_parser().parse_args(args)
+  if options.serve is not None:
+    serve(options)
+    return 0
+  command = options.command
+  if command and command[0] == '--':
+    command = command[1:]
+  if not command:
+    make_parser().error('No compile command given')
+  return compile(options, command)
+
+if __name__ == '__main__':
+  sys.exit(main())
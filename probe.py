@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""Persistent cache for toolchain probes
+
+Toolchain setup queries the host with external commands (xcrun, uname, reg) and
+the Visual Studio setup API. Results are stored in a JSON file in the build
+directory and reused by later runs as long as the inputs they were derived from
+are unchanged: a set of environment variables, the build preference files and
+the modification times of the probed tools and of paths they returned.
+Commands not found in the cache can be run concurrently with prefetch.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+#Bump to discard caches written by an incompatible version
+cache_version = 1
+
+#Environment variables affecting what the probed tools report
+environment_keys = ['PATH', 'DEVELOPER_DIR', 'SDKROOT', 'TOOLCHAINS', 'NDK_HOME', 'ANDROID_HOME',
+                    'PROCESSOR_ARCHITECTURE', 'ProgramData', 'ProgramFiles', 'ProgramFiles(x86)']
+
+#Additional paths whose changes invalidate the results of a command
+command_depends = {
+  'xcrun': ['/var/db/xcode_select_link']
+}
+
+def path_stamp(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  stamp = [stat.st_mtime_ns, stat.st_size]
+  if os.path.islink(path):
+    #Switching a tool or SDK symlink to another install is a change even if the new target is older
+    stamp += [os.readlink(path)]
+  return stamp
+
+def command_key(args):
+  return json.dumps(list(args))
+
+class ProbeCache(object):
+  def __init__(self, filename, prefsfiles = None, enabled = True):
+    #prefsfiles is a function returning the preference files, evaluated when the cache is loaded
+    self.filename = filename
+    self.prefsfiles = prefsfiles
+    self.enabled = enabled
+    self.entries = None
+    self.fingerprint = None
+    self.dirty = False
+    self.runs = 0
+    self.lock = threading.Lock()
+
+  def fingerprint_inputs(self):
+    environment = dict((key, os.environ.get(key)) for key in environment_keys)
+    prefsfiles = self.prefsfiles() if self.prefsfiles else []
+    prefs = dict((filename, path_stamp(filename)) for filename in prefsfiles)
+    return {'version': cache_version, 'environment': environment, 'prefs': prefs}
+
+  def load(self):
+    if self.entries is not None:
+      return
+    self.entries = {}
+    self.fingerprint = hashlib.sha1(json.dumps(self.fingerprint_inputs(), sort_keys = True).encode()).hexdigest()
+    if not self.enabled or not os.path.isfile(self.filename):
+      return
+    try:
+      with open(self.filename, 'r') as cachefile:
+        cache = json.load(cachefile)
+    except (OSError, ValueError):
+      return
+    if cache.get('fingerprint') != self.fingerprint:
+      return
+    for key, entry in cache.get('probes', {}).items():
+      if not 'error' in entry and self.is_valid(entry):
+        self.entries[key] = entry
+
+  def save(self):
+    """Write the cache file if probes were run since it was loaded"""
+    if not self.enabled or not self.dirty:
+      return
+    path = os.path.dirname(self.filename)
+    if path != '' and not os.path.isdir(path):
+      os.makedirs(path)
+    #A tool that could not be run has no path to revalidate, so it is probed again next run
+    probes = dict((key, entry) for key, entry in self.entries.items() if not 'error' in entry)
+    tmpfile = self.filename + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpfile, 'w') as cachefile:
+      json.dump({'fingerprint': self.fingerprint, 'probes': probes}, cachefile, indent = 1, sort_keys = True)
+    os.replace(tmpfile, self.filename)
+    self.dirty = False
+
+  def merge(self, entries):
+    """Add entries probed by another cache, such as one in a worker process"""
+    self.load()
+    with self.lock:
+      for key, entry in entries.items():
+        if key not in self.entries:
+          self.entries[key] = entry
+          self.dirty = True
+
+  def is_valid(self, entry):
+    for path, stamp in entry.get('depends', {}).items():
+      if path_stamp(path) != stamp:
+        return False
+    return True
+
+  def make_depends(self, paths):
+    return dict((path, path_stamp(path)) for path in paths if path)
+
+  def run_command(self, args, depends):
+    #Runs outside the lock so prefetched commands execute concurrently
+    tool = shutil.which(args[0])
+    entry = {}
+    try:
+      process = subprocess.run(list(args), stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+      entry['returncode'] = process.returncode
+      entry['output'] = process.stdout.decode(errors = 'replace').strip()
+    except OSError as e:
+      entry['error'] = str(e)
+    paths = [tool] + command_depends.get(args[0], []) + list(depends or [])
+    lastline = entry.get('output', '').splitlines()[-1:]
+    if lastline and os.path.isabs(lastline[0]):
+      #A returned path, like an SDK or tool location, is revalidated on later runs
+      paths += lastline
+    entry['depends'] = self.make_depends(paths)
+    with self.lock:
+      self.runs += 1
+    return entry
+
+  def store(self, key, entry):
+    with self.lock:
+      self.entries[key] = entry
+      self.dirty = True
+
+  def prefetch(self, commands, depends = None, jobs = 8):
+    """Run the given commands not yet cached concurrently, storing the results"""
+    self.load()
+    pending = {}
+    for args in commands:
+      key = command_key(args)
+      if key not in self.entries:
+        pending[key] = args
+    pending = list(pending.items())
+    if not pending:
+      return
+    if len(pending) == 1 or jobs <= 1:
+      for key, args in pending:
+        self.store(key, self.run_command(args, depends))
+      return
+    with ThreadPoolExecutor(max_workers = min(jobs, len(pending))) as executor:
+      results = executor.map(lambda item: (item[0], self.run_command(item[1], depends)), pending)
+      for key, entry in results:
+        self.store(key, entry)
+
+  def check_output(self, args, depends = None):
+    """Cached equivalent of subprocess.check_output(args), decoded and stripped.
+    Raises CalledProcessError or OSError like the uncached call would"""
+    self.load()
+    key = command_key(args)
+    entry = self.entries.get(key)
+    if entry is None:
+      entry = self.run_command(args, depends)
+      self.store(key, entry)
+    if 'error' in entry:
+      raise OSError(entry['error'])
+    if entry['returncode'] != 0:
+      raise subprocess.CalledProcessError(entry['returncode'], list(args), entry['output'])
+    return entry['output']
+
+  def check_last_output(self, args, depends = None):
+    return self.check_output(args, depends).splitlines()[-1]
+
+  def call(self, name, function, depends = None):
+    """Cached result of calling function, which must return a JSON serializable value"""
+    self.load()
+    key = 'call:' + name
+    entry = self.entries.get(key)
+    if entry is None:
+      entry = {'result': function(), 'depends': self.make_depends(depends or [])}
+      with self.lock:
+        self.runs += 1
+      self.store(key, entry)
+    return entry['result']
@@ -13,16 +13,37 @@ def escape_path(word):
     return word.replace('$ ', '$$ ').replace(' ', '$ ').replace(':', '$:')
 
 class Writer(object):
-    def __init__(self, output, width=78):
+    def __init__(self, output, width=78, buffersize=65536):
+        """Lines are collected in memory and written to 'output' in chunks of
+        roughly 'buffersize' characters. A width of 0 or None disables line
+        wrapping (compact mode)."""
         self.output = output
         self.width = width
+        self.buffersize = buffersize
+        self._buffer = []
+        self._buffered = 0
+
+    def flush(self):
+        """Write all buffered lines to the output."""
+        if self._buffer:
+            self.output.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        """Flush buffered lines and close the output."""
+        self.flush()
+        self.output.close()
 
     def newline(self):
-        self.output.write('\n')
+        self._write('\n')
 
     def comment(self, text):
+        if not self.width:
+            self._write('# ' + ' '.join(text.split()) + '\n')
+            return
         for line in textwrap.wrap(text, self.width - 2):
-            self.output.write('# ' + line + '\n')
+            self._write('# ' + line + '\n')
 
     def variable(self, key, value, indent=0):
         if value is None:
@@ -95,11 +116,18 @@ class Writer(object):
     def default(self, paths):
         self._line('default %s' % ' '.join(self._as_list(paths)))
 
-    def _count_dollars_before_index(self, s, i):
-        """Returns the number of '$' characters right in front of s[i]."""
+    def _write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffersize:
+            self.flush()
+
+    def _count_dollars_before_index(self, s, i, start=0):
+        """Returns the number of '$' characters right in front of s[i], not
+        counting s[start]."""
         dollar_count = 0
         dollar_index = i - 1
-        while dollar_index > 0 and s[dollar_index] == '$':
+        while dollar_index > start and s[dollar_index] == '$':
             dollar_count += 1
             dollar_index -= 1
         return dollar_count
@@ -107,44 +135,55 @@ class Writer(object):
     def _line(self, text, indent=0):
         """Write 'text' word-wrapped at self.width characters."""
         leading_space = '  ' * indent
-        while len(leading_space) + len(text) > self.width:
+        if not self.width or len(leading_space) + len(text) <= self.width:
+            self._write(leading_space + text + '\n')
+            return
+
+        # Wrap at offsets into the text rather than slicing it, so breaking a
+        # long line does not copy the remainder for every break.
+        start = 0
+        parts = []
+        while len(leading_space) + len(text) - start > self.width:
             # The text is too wide; wrap if possible.
 
             # Find the rightmost space that would obey our width constraint and
             # that's not an escaped space.
-            available_space = self.width - len(leading_space) - len(' $')
+            available_space = start + self.width - len(leading_space) - len(' $')
             space = available_space
             while True:
-                space = text.rfind(' ', 0, space)
+                space = text.rfind(' ', start, space)
                 if (space < 0 or
-                    self._count_dollars_before_index(text, space) % 2 == 0):
+                    self._count_dollars_before_index(text, space, start) % 2 == 0):
                     break
 
             if space < 0:
                 # No such space; just use the first unescaped space we can find.
-                space = available_space - 1
+                space = max(available_space, start) - 1
                 while True:
                     space = text.find(' ', space + 1)
                     if (space < 0 or
-                        self._count_dollars_before_index(text, space) % 2 == 0):
+                        self._count_dollars_before_index(text, space, start) % 2 == 0):
                         break
             if space < 0:
                 # Give up on breaking.
                 break
 
-            self.output.write(leading_space + text[0:space] + ' $\n')
-            text = text[space+1:]
+            parts.append(leading_space + text[start:space] + ' $\n')
+            start = space + 1
 
             # Subsequent lines are continuations, so indent them.
             leading_space = '  ' * (indent+2)
 
-        self.output.write(leading_space + text + '\n')
+        parts.append(leading_space + text[start:] + '\n')
+        self._write(''.join(parts))
 
     def _as_list(self, input):
         if input is None:
             return []
         if isinstance(input, list):
             return input
+        if isinstance(input, tuple):
+            return list(input)
         return [input]
 
 
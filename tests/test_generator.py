@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""Generator tests
+
+Each test configures a small project laid out like the foundation library, with a
+library in foundation/ and test cases in test/<case>/ built as test-<case>, using
+a copy of the generator as build/ninja.
+"""
+
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+configure_script = """#!/usr/bin/env python
+import sys, os
+sys.path.insert(0, os.path.join('build', 'ninja'))
+import generator
+generator = generator.Generator(project = 'foundation')
+lib = generator.lib(module = 'foundation', sources = ['array.c', 'hash.c', 'version.c'])
+if not generator.is_subninja():
+  includepaths = generator.test_includepaths()
+  for test in ['all', 'array']:
+    generator.bin(module = test, sources = ['main.c'], binname = 'test-' + test, basepath = 'test', implicit_deps = [lib], libs = ['foundation'], includepaths = includepaths)
+"""
+
+class ProjectTestCase(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.path)
+    os.makedirs(os.path.join(self.path, 'build', 'ninja'))
+    for module in glob.glob(os.path.join(root, '*.py')):
+      shutil.copy(module, os.path.join(self.path, 'build', 'ninja'))
+    self.write('configure.py', configure_script)
+    self.write(os.path.join('foundation', 'foundation.h'), '#pragma once\n#include <foundation/version.h>\n')
+    self.write(os.path.join('foundation', 'version.h'), '#pragma once\ntypedef unsigned long long version_t;\nversion_t version_make(unsigned int, unsigned int, unsigned int, unsigned int, unsigned int);\n')
+    self.write(os.path.join('foundation', 'array.c'), '#include <foundation/foundation.h>\nint array_size(void) { return 1; }\n')
+    self.write(os.path.join('foundation', 'hash.c'), '#include <foundation/foundation.h>\nint hash_size(void) { return 2; }\n')
+    for test in ['all', 'array']:
+      self.write(os.path.join('test', test, 'main.c'), 'int main(void) { return 0; }\n')
+
+  def write(self, name, content):
+    path = os.path.join(self.path, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as file:
+      file.write(content)
+
+  def configure(self, *args, **kwargs):
+    return subprocess.run([sys.executable, 'configure.py', '--target', 'linux', '--toolchain', 'gcc', '-c', 'debug', '-a', 'x86-64'] + list(args), cwd = self.path,
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT, check = True, **kwargs).stdout.decode()
+
+  def ninja(self, *args):
+    return subprocess.run(['ninja', '-n'] + list(args), cwd = self.path, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+
+  def affected(self, *paths):
+    output = self.configure('--affected', '-', input = '\n'.join(paths).encode())
+    return json.loads(output[output.index('{'):])
+
+def bin_path(name):
+  return os.path.join('bin', 'linux', 'debug', 'x86-64', name)
+
+class TestAffected(ProjectTestCase):
+  def test_targets(self):
+    #Only the binary built from the source, not the aliases depending on it
+    affected = self.affected(os.path.join('test', 'array', 'main.c'))
+    self.assertEqual(affected['targets'], [bin_path('test-array')])
+
+  def test_library_targets(self):
+    affected = self.affected(os.path.join('foundation', 'hash.c'))
+    self.assertEqual(sorted(affected['targets']), [bin_path('test-all'), bin_path('test-array')])
+
+  def test_test_binaries(self):
+    affected = self.affected(os.path.join('test', 'array', 'main.c'))
+    self.assertFalse(affected['full'])
+    self.assertEqual(affected['tests'], [bin_path('test-array')])
+
+  def test_full_test_binaries(self):
+    affected = self.affected('configure.py')
+    self.assertTrue(affected['full'])
+    self.assertEqual(sorted(affected['tests']), [bin_path('test-' + test) for test in ['all', 'array']])
+
+  def test_configure_args(self):
+    #A query is not repeated when ninja regenerates the build files
+    self.affected(os.path.join('test', 'array', 'main.c'))
+    with open(os.path.join(self.path, 'build.ninja'), 'r') as buildfile:
+      args = [line for line in buildfile.read().splitlines() if line.startswith('configure_args = ')]
+    self.assertEqual(args, ['configure_args = --target linux --toolchain gcc -c debug -a x86-64'])
+
+class TestConfigure(ProjectTestCase):
+  def read_buildfile(self):
+    with open(os.path.join(self.path, 'build.ninja'), 'r') as buildfile:
+      return buildfile.read()
+
+  def assertKeepsBuildFile(self, exit):
+    #A configure script exiting with a failure status keeps the previous build files
+    self.configure()
+    previous = self.read_buildfile()
+    self.write('configure.py', configure_script.replace("if not generator.is_subninja():", exit + "\nif not generator.is_subninja():"))
+    self.assertRaises(subprocess.CalledProcessError, self.configure)
+    self.assertEqual(self.read_buildfile(), previous)
+
+  def test_failed_configure(self):
+    self.assertKeepsBuildFile('sys.exit(1)')
+
+  def test_raised_exit(self):
+    self.assertKeepsBuildFile('raise SystemExit(1)')
+
+  def test_closed_exit(self):
+    #A script closing the generator before exiting early writes the build files
+    self.write('configure.py', configure_script.replace("if not generator.is_subninja():", "generator.close()\nsys.exit()\nif not generator.is_subninja():"))
+    self.configure()
+    self.assertIn('foundation', self.read_buildfile())
+    self.assertNotIn('test-all', self.read_buildfile())
+
+  def test_write_error(self):
+    #Failing to write the build files gives a failure status
+    self.assertRaises(subprocess.CalledProcessError, self.configure, '--buildfile', os.path.join('configure.py', 'build.ninja'))
+
+@unittest.skipUnless(shutil.which('ninja'), 'ninja not found')
+class TestBuildFiles(ProjectTestCase):
+  def assertBuilds(self, *args):
+    result = self.ninja(*args)
+    self.assertEqual(result.returncode, 0, result.stdout.decode())
+    return result.stdout.decode()
+
+  def test_build(self):
+    self.configure()
+    self.assertIn('VERSION foundation', self.assertBuilds())
+
+  def test_partition(self):
+    #Every entry point can build its slice from a clean tree, version sources included
+    self.configure('--partition', '--specializerules')
+    self.assertBuilds()
+    self.assertIn('VERSION foundation', self.assertBuilds('-f', os.path.join('build', 'ninja', 'linux', 'build-debug-x86-64.ninja')))
+
+  def test_version_source(self):
+    #The library version.c is generated in the build directory, not the source tree
+    self.configure()
+    self.assertFalse(os.path.exists(os.path.join(self.path, 'foundation', 'version.c')))
+    self.assertIn(os.path.join('build', 'ninja', 'linux', 'version', 'foundation', 'version.c'), self.assertBuilds())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""Graph tests"""
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph
+import syntax
+
+def make_graph(prefixes = []):
+  #Library from two sources, two test binaries linking it and aliases on top
+  buildgraph = graph.Graph()
+  for prefix in prefixes:
+    buildgraph.note_prefix(prefix)
+  buildgraph.variable('buildpath', 'build/ninja/linux')
+  buildgraph.rule('cc', command = 'cc -c $in -o $out')
+  buildgraph.rule('ar', command = 'ar crs $out $in')
+  buildgraph.rule('link', command = 'cc $in -o $out')
+  buildgraph.build('$buildpath/lib/array.o', 'cc', 'lib/array.c')
+  buildgraph.build('$buildpath/lib/hash.o', 'cc', 'lib/hash.c')
+  buildgraph.build('lib/libfoundation.a', 'ar', ['$buildpath/lib/array.o', '$buildpath/lib/hash.o'])
+  for test in ['all', 'array']:
+    buildgraph.build('$buildpath/test/' + test + '.o', 'cc', 'test/' + test + '/main.c')
+    buildgraph.build('bin/test-' + test, 'link', '$buildpath/test/' + test + '.o', implicit = 'lib/libfoundation.a')
+    buildgraph.build(test, 'phony', 'bin/test-' + test)
+  buildgraph.build('debug', 'phony', ['bin/test-all', 'bin/test-array'])
+  buildgraph.default('debug')
+  return buildgraph
+
+class TestGraphIndex(unittest.TestCase):
+  def setUp(self):
+    self.index = graph.GraphIndex([make_graph()])
+
+  def test_targets(self):
+    self.assertEqual(self.index.targets(['test/array/main.c']), ['bin/test-array'])
+    self.assertEqual(self.index.targets(['lib/hash.c']), ['bin/test-all', 'bin/test-array'])
+
+  def test_unknown_file(self):
+    self.assertEqual(self.index.targets(['README.md']), [])
+
+  def test_aliases(self):
+    #Aliases are neither producers nor consumers, so they are never reported as targets
+    self.assertNotIn('debug', self.index.producers)
+    self.assertNotIn(os.path.normpath('bin/test-all'), self.index.consumers)
+    self.assertEqual(sorted(self.index.defaults()), ['bin/test-all', 'bin/test-array'])
+
+  def test_expanded_paths(self):
+    self.assertIn(os.path.normpath('build/ninja/linux/lib/array.o'), self.index.producers)
+    self.assertEqual(sorted(self.index.sources()), sorted([os.path.normpath(path) for path in ['lib/array.c', 'lib/hash.c', 'test/all/main.c', 'test/array/main.c']]))
+
+  def test_deps(self):
+    #Headers recorded in the deps log affect the objects including them
+    self.index.add_deps(graph.parse_deps('build/ninja/linux/lib/hash.o: #deps 2, deps mtime 1 (VALID)\n    lib/hash.c\n    lib/hash.h\n\n'))
+    self.assertTrue(self.index.deps)
+    self.assertEqual(self.index.targets(['lib/hash.h']), ['bin/test-all', 'bin/test-array'])
+
+class TestGraph(unittest.TestCase):
+  def write(self, buildgraph):
+    output = io.StringIO()
+    writer = syntax.Writer(output)
+    buildgraph.write(writer)
+    writer.flush()
+    return output.getvalue()
+
+  def test_write(self):
+    buildgraph = graph.Graph()
+    buildgraph.variable('cflags', ['-O2', '', '-g'])
+    buildgraph.rule('cc', command = 'cc $cflags -c $in -o $out', depfile = '$out.d', deps = 'gcc')
+    buildgraph.build('a b.o', 'cc', 'a b.c', variables = {'cflags': '-O0'})
+    self.assertEqual(self.write(buildgraph), 'cflags = -O2 -g\n'
+                     'rule cc\n  command = cc $cflags -c $in -o $out\n  depfile = $out.d\n  deps = gcc\n'
+                     'build a$ b.o: cc a$ b.c\n  cflags = -O0\n')
+
+  def test_deduplicate(self):
+    buildgraph = graph.Graph()
+    for _ in range(2):
+      buildgraph.build('a.o', 'cc', 'a.c', variables = [('cflags', '-O2')])
+    buildgraph.build('a.o', 'cc', 'a.c', variables = [('cflags', '-O0')])
+    self.assertEqual(buildgraph.deduplicate(), 1)
+    self.assertEqual(len(buildgraph.edges()), 2)
+
+  def test_stream(self):
+    #Appended graphs are written out and released, duplicates within them dropped
+    output = io.StringIO()
+    writer = syntax.Writer(output)
+    buildgraph = graph.Graph()
+    buildgraph.variable('cflags', '-O2')
+    buildgraph.stream(writer)
+    slicegraph = graph.Graph()
+    for _ in range(2):
+      slicegraph.build('a.o', 'cc', 'a.c')
+    buildgraph.append(slicegraph)
+    self.assertEqual(buildgraph.statements, [])
+    buildgraph.build('all', 'phony', 'a.o')
+    buildgraph.flush()
+    writer.flush()
+    self.assertEqual(output.getvalue(), 'cflags = -O2\nbuild a.o: cc a.c\nbuild all: phony a.o\n')
+
+  def test_replace_prefixes(self):
+    buildgraph = make_graph(['$buildpath', '$buildpath/lib'])
+    #Paths count for the longest prefix they are below
+    self.assertEqual(buildgraph.prefix_uses(), {'$buildpath': 4, '$buildpath/lib': 4})
+    buildgraph.replace_prefixes({'$buildpath/lib': '$p1_1', '$buildpath': '$p1_2'})
+    buildgraph.define('p1_1', '$buildpath/lib')
+    text = self.write(buildgraph)
+    self.assertTrue(text.startswith('p1_1 = $buildpath/lib\n'))
+    self.assertIn('build lib/libfoundation.a: ar $p1_1/array.o $p1_1/hash.o\n', text)
+    self.assertIn('build $p1_2/test/all.o: cc test/all/main.c\n', text)
+    self.assertIn('build bin/test-all: link $p1_2/test/all.o | lib/libfoundation.a\n', text)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""Object cache tests
+
+Compiles go through a stand-in compiler script which preprocesses by copying the
+source, compiles by writing the source reversed and logs every compile, so cache
+hits can be told apart from compiles.
+"""
+
+import io
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import objcache
+
+compiler_script = """#!/usr/bin/env python
+import sys
+args = sys.argv[1:]
+source = [arg for arg in args if arg.endswith('.c')][0]
+content = open(source).read()
+if '-E' in args:
+  sys.stdout.write(content)
+  sys.exit(0)
+output = args[args.index('-o') + 1]
+open(output, 'w').write(content[::-1])
+if '-MF' in args:
+  open(args[args.index('-MF') + 1], 'w').write(output + ': ' + source + ' header.h\\n')
+open('compiles.log', 'a').write(output + '\\n')
+sys.stdout.write('warning: ' + source + '\\n')
+"""
+
+class TestCompileCommand(unittest.TestCase):
+  def test_parse(self):
+    command = objcache.CompileCommand(['ccache', 'gcc', '-MMD', '-MT', 'a.o', '-MF', 'a.o.d', '-Iinclude', '-include', 'config.h', '-DX=1', '-c', 'a.c', '-o', 'a.o'])
+    self.assertEqual(command.launcher, ['ccache'])
+    self.assertEqual(command.compiler, 'gcc')
+    self.assertEqual(command.output, 'a.o')
+    self.assertEqual(command.depfile, 'a.o.d')
+    self.assertEqual(command.sources, ['a.c'])
+    self.assertTrue(command.cacheable())
+    #Output paths are left out of the key and the preprocess command
+    self.assertEqual(command.keyargs, ['-Iinclude', '-include', 'config.h', '-DX=1', 'a.c'])
+    self.assertEqual(command.preprocess, ['gcc', '-Iinclude', '-include', 'config.h', '-DX=1', 'a.c', '-E'])
+
+  def test_environment(self):
+    #Leading assignments, like the PATH given to Xcode tools, are not the compiler
+    command = objcache.CompileCommand(['PATH=/sdk/bin:/usr/bin', 'ccache', '/sdk/bin/clang', '-c', 'a.c', '-o', 'a.o'])
+    self.assertEqual(command.environment, {'PATH': '/sdk/bin:/usr/bin'})
+    self.assertEqual(command.compiler, '/sdk/bin/clang')
+    self.assertEqual(command.command(), ['ccache', '/sdk/bin/clang', '-c', 'a.c', '-o', 'a.o'])
+    self.assertEqual(command.env()['PATH'], '/sdk/bin:/usr/bin')
+    self.assertIsNone(objcache.CompileCommand(['gcc', '-c', 'a.c', '-o', 'a.o']).env())
+
+  def test_not_cacheable(self):
+    self.assertFalse(objcache.CompileCommand(['gcc', 'a.c', '-o', 'a']).cacheable())
+    self.assertFalse(objcache.CompileCommand(['gcc', '-c', 'a.c', 'b.c']).cacheable())
+    self.assertFalse(objcache.CompileCommand(['clang', '-include-pch', 'a.pch', '-c', 'a.c', '-o', 'a.o']).cacheable())
+    self.assertFalse(objcache.CompileCommand(['gcc', '-x', 'c-header', '-c', 'a.h', '-o', 'a.h.gch']).cacheable())
+
+  def test_prefix_map(self):
+    cwd = os.getcwd()
+    command = objcache.CompileCommand(['gcc', '-fdebug-prefix-map=' + cwd + '=.', '-c', 'a.c', '-o', 'a.o'])
+    self.assertEqual(command.keyargs, ['-fdebug-prefix-map=.', 'a.c'])
+    self.assertEqual(command.working_directory(), '')
+    self.assertEqual(objcache.CompileCommand(['gcc', '-c', 'a.c', '-o', 'a.o']).working_directory(), cwd)
+
+class CacheTestCase(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.path)
+    os.chdir(self.path)
+    self.addCleanup(os.chdir, self.cwd)
+
+class TestLocalBackend(CacheTestCase):
+  def test_round_trip(self):
+    backend = objcache.LocalBackend('cache', 1024 * 1024)
+    self.assertIsNone(backend.get('ab' + '0' * 62))
+    backend.put('ab' + '0' * 62, b'entry')
+    self.assertEqual(backend.get('ab' + '0' * 62), b'entry')
+    self.assertTrue(os.path.isfile(os.path.join('cache', 'ab', 'ab' + '0' * 62 + '.zip')))
+
+  def test_evict(self):
+    #Buckets of 100 bytes, the least recently used entries are evicted first
+    backend = objcache.LocalBackend('cache', objcache.bucket_count * 100)
+    keys = ['ab' + str(index) * 62 for index in range(3)]
+    for index, key in enumerate(keys[:2]):
+      backend.put(key, b'x' * 40)
+      os.utime(backend.entry_path(key), (index, index))
+    backend.put(keys[2], b'x' * 40)
+    self.assertIsNone(backend.get(keys[0]))
+    self.assertIsNotNone(backend.get(keys[1]))
+    self.assertIsNotNone(backend.get(keys[2]))
+
+class TestCompile(CacheTestCase):
+  def setUp(self):
+    super(TestCompile, self).setUp()
+    with open('cc.py', 'w') as script:
+      script.write(compiler_script)
+    os.chmod('cc.py', os.stat('cc.py').st_mode | stat.S_IEXEC)
+    with open('a.c', 'w') as source:
+      source.write('int a;\n')
+
+  def compile(self, output, prefix = []):
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+      result = objcache.main(['--dir', 'cache', '--'] + prefix + [os.path.abspath('cc.py'), '-MMD', '-MT', output, '-MF', output + '.d', '-c', 'a.c', '-o', output])
+      return result, sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+
+  def compiles(self):
+    with open('compiles.log', 'r') as log:
+      return log.read().split()
+
+  def read(self, path):
+    with open(path, 'r') as file:
+      return file.read()
+
+  def test_hit(self):
+    self.assertEqual(self.compile('a.o'), (0, 'warning: a.c\n'))
+    #A hit restores the object, the compiler output and the depfile for the new output path
+    self.assertEqual(self.compile('b.o'), (0, 'warning: a.c\n'))
+    self.assertEqual(self.compiles(), ['a.o'])
+    self.assertEqual(self.read('b.o'), self.read('a.o'))
+    self.assertEqual(self.read('b.o.d'), 'b.o: a.c header.h\n')
+
+  def test_miss(self):
+    self.compile('a.o')
+    with open('a.c', 'w') as source:
+      source.write('int b;\n')
+    self.compile('a.o')
+    self.assertEqual(self.compiles(), ['a.o', 'a.o'])
+    self.assertEqual(self.read('a.o'), '\n;b tni')
+
+  def test_environment(self):
+    self.assertEqual(self.compile('a.o', ['OBJCACHE_TEST=1']), (0, 'warning: a.c\n'))
+    self.assertEqual(self.compile('b.o', ['OBJCACHE_TEST=1']), (0, 'warning: a.c\n'))
+    self.assertEqual(self.compiles(), ['a.o'])
+
+  def test_missing_compiler(self):
+    #A compiler that cannot be run gives no key, the plain command then reports the error
+    command = [os.path.abspath('missing'), '-c', 'a.c', '-o', 'a.o']
+    self.assertIsNone(objcache.make_key(objcache.CompileCommand(command)))
+    self.assertRaises(OSError, objcache.main, ['--dir', 'cache', '--'] + command)
+
+  def test_disable(self):
+    os.environ['OBJCACHE_DISABLE'] = '1'
+    try:
+      self.compile('a.o')
+      self.compile('a.o')
+    finally:
+      del os.environ['OBJCACHE_DISABLE']
+    self.assertEqual(self.compiles(), ['a.o', 'a.o'])
+    self.assertFalse(os.path.isdir('cache'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""PList utility tests"""
+
+import os
+import plistlib
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plist
+
+base_plist = {
+  'CFBundleExecutable': '$(EXECUTABLE_NAME)',
+  'CFBundleIdentifier': 'com.example.${PRODUCT_NAME:rfc1034identifier}',
+  'CFBundleName': '$(PRODUCT_NAME)',
+  'CFBundlePackageType': 'APPL',
+  'CFBundleSignature': 'FNDT',
+  'LSMinimumSystemVersion': '$(MACOSX_DEPLOYMENT_TARGET)',
+  'NSAppTransportSecurity': {'NSAllowsArbitraryLoads': False, 'NSExceptionDomains': {}},
+  'CFBundleDocumentTypes': [{'CFBundleTypeName': '$(PRODUCT_NAME) document'}]
+}
+
+class TestBuildPlist(unittest.TestCase):
+  def options(self, *args):
+    return plist.parse_options(['--exename', 'Test-App', '--prodname', 'Test App', '--buildversion', '21A559'] + list(args) + ['Info.plist'])
+
+  def test_merge(self):
+    #Dictionaries present in both plists are merged, other values replaced
+    info, _ = plist.build_plist([base_plist, {'CFBundleName': 'Other', 'NSAppTransportSecurity': {'NSAllowsArbitraryLoads': True}}], self.options())
+    self.assertEqual(info['CFBundleName'], 'Other')
+    self.assertEqual(info['NSAppTransportSecurity'], {'NSAllowsArbitraryLoads': True, 'NSExceptionDomains': {}})
+    self.assertEqual(base_plist['NSAppTransportSecurity']['NSAllowsArbitraryLoads'], False)
+
+  def test_substitute(self):
+    info, _ = plist.build_plist([base_plist], self.options('--deploymenttarget', '11.0'))
+    self.assertEqual(info['CFBundleExecutable'], 'Test-App')
+    self.assertEqual(info['CFBundleIdentifier'], 'com.example.test-app')
+    self.assertEqual(info['LSMinimumSystemVersion'], '11.0')
+    self.assertEqual(info['CFBundleDocumentTypes'], [{'CFBundleTypeName': 'Test App document'}])
+
+  def test_bundle(self):
+    info, _ = plist.build_plist([base_plist], self.options('--bundle', 'com.example.bundle'))
+    self.assertEqual(info['CFBundleIdentifier'], 'com.example.bundle')
+
+  def test_pkginfo(self):
+    self.assertEqual(plist.build_plist([base_plist], self.options())[1], 'APPLFNDT')
+    self.assertEqual(plist.build_plist([{}], self.options())[1], 'APPL????')
+
+  def test_buildversion(self):
+    info, _ = plist.build_plist([base_plist], self.options())
+    self.assertEqual(info['BuildMachineOSBuild'], '21A559')
+
+class TestMain(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.path)
+
+  def test_output(self):
+    source = os.path.join(self.path, 'Info.plist')
+    with open(source, 'wb') as plist_file:
+      plistlib.dump(base_plist, plist_file)
+    output = os.path.join(self.path, 'app', 'Contents', 'Info.plist')
+    os.makedirs(os.path.dirname(output))
+    plist.main(['--exename', 'test', '--prodname', 'test', '--buildversion', '21A559', '--output', output, source, os.path.join(self.path, 'icon.icns')])
+    with open(os.path.join(os.path.dirname(output), 'PkgInfo'), 'r') as pkginfo_file:
+      self.assertEqual(pkginfo_file.read(), 'APPLFNDT')
+    with open(output, 'rb') as plist_file:
+      self.assertTrue(plist_file.read().startswith(b'bplist00'))
+    info = plist.load_plist(output)
+    self.assertEqual(info['CFBundleExecutable'], 'test')
+    self.assertEqual(info['BuildMachineOSBuild'], '21A559')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Probe cache tests"""
+
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import probe
+
+@unittest.skipIf(sys.platform.startswith('win'), 'probe tools are shell scripts')
+class TestProbeCache(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.path)
+    self.bin = os.path.join(self.path, 'bin')
+    os.makedirs(self.bin)
+    self.environ = os.environ.copy()
+    self.addCleanup(os.environ.update, self.environ)
+    os.environ['PATH'] = self.bin + os.pathsep + os.environ.get('PATH', '')
+    self.filename = os.path.join(self.path, 'probes.json')
+
+  def tool(self, name, output):
+    #Tool logging each run, so cached results can be told apart from runs
+    path = os.path.join(self.bin, name)
+    with open(path, 'w') as script:
+      script.write('#!/bin/sh\necho run >> ' + os.path.join(self.path, name + '.log') + '\necho ' + output + '\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+  def runs(self, name):
+    try:
+      with open(os.path.join(self.path, name + '.log'), 'r') as log:
+        return len(log.read().split())
+    except IOError:
+      return 0
+
+  def cache(self):
+    return probe.ProbeCache(self.filename)
+
+  def test_cached(self):
+    self.tool('sdkinfo', '1.0')
+    cache = self.cache()
+    self.assertEqual(cache.check_output(['sdkinfo']), '1.0')
+    cache.save()
+    self.assertEqual(self.cache().check_output(['sdkinfo']), '1.0')
+    self.assertEqual(self.runs('sdkinfo'), 1)
+
+  def test_changed_tool(self):
+    self.tool('sdkinfo', '1.0')
+    cache = self.cache()
+    cache.check_output(['sdkinfo'])
+    cache.save()
+    self.tool('sdkinfo', '2.0.0')
+    self.assertEqual(self.cache().check_output(['sdkinfo']), '2.0.0')
+
+  def test_missing_tool(self):
+    #A tool installed after a failed probe is found without changing PATH
+    cache = self.cache()
+    self.assertRaises(OSError, cache.check_output, ['sdkinfo'])
+    cache.save()
+    self.tool('sdkinfo', '1.0')
+    self.assertEqual(self.cache().check_output(['sdkinfo']), '1.0')
+
+  def test_failed_command(self):
+    cache = self.cache()
+    self.assertRaises(subprocess.CalledProcessError, cache.check_output, ['sh', '-c', 'exit 3'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,19 +4,24 @@
 
 import sys
 import os
+import collections
+import collections.abc
+import fnmatch
 import subprocess
 import random
 import string
 import json
+import re
 import zlib
+import hashlib
 
+import graph
 import platform
-import version
+import probe
+import syntax
 import android
 import xcode
 
-created_directories = {}
-
 def check_output(args):
   import subprocess
   return subprocess.check_output(args).decode().strip()
@@ -35,6 +40,12 @@ def supported_architectures():
 def get_boolean_flag(val):
   return (val == True or val == "True" or val == "true" or val == "1" or val == 1)
 
+def get_name_list(val):
+  #Names given as a list or a comma separated string
+  if isinstance(val, str):
+    val = val.split(',')
+  return [name.strip() for name in val if name.strip()]
+
 def make_toolchain(host, target, toolchain):
   if toolchain is None:
     if target.is_raspberrypi():
@@ -48,7 +59,157 @@ def make_toolchain(host, target, toolchain):
   return toolchainmodule.create(host, target, toolchain)
 
 def make_pathhash(path, targettype):
-  return '-' + hex(zlib.adler32((path + targettype).encode()) & 0xffffffff)[2:-1]
+  return '-%08x' % (zlib.adler32((path + targettype).encode()) & 0xffffffff)
+
+def make_longpathhash(path, targettype):
+  return '-' + hashlib.sha1((path + targettype).encode()).hexdigest()[:16]
+
+#Language kind of each source extension, sources of a kind share unity translation units
+#and precompiled headers
+source_kinds = {'c': 'c', 'cc': 'cpp', 'cpp': 'cpp', 'm': 'm'}
+
+#Compiler launchers known to distribute compiles to other hosts
+remote_launchers = ['distcc', 'icecc']
+
+def split_environment(command):
+  #Split leading environment assignments, like the PATH given to Xcode tools, from a command
+  words = command.split(' ')
+  count = 0
+  while count < len(words) - 1 and re.match(r'[A-Za-z_][A-Za-z0-9_]*=', words[count]):
+    count += 1
+  return ' '.join(words[:count]), ' '.join(words[count:])
+
+def write_if_changed(filename, content):
+  #Leave an unchanged file untouched so edges depending on it are not rebuilt
+  if os.path.isfile(filename):
+    with open(filename, 'r') as file:
+      if file.read() == content:
+        return False
+  path = os.path.dirname(filename)
+  if path != '' and not os.path.isdir(path):
+    os.makedirs(path)
+  with open(filename, 'w') as file:
+    file.write(content)
+  return True
+
+immutable_types = (str, int, float, bool, type(None))
+
+def freeze(value):
+  if isinstance(value, immutable_types):
+    return value
+  if isinstance(value, (list, tuple)):
+    return tuple([item if isinstance(item, immutable_types) else freeze(item) for item in value])
+  if isinstance(value, dict):
+    return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+  if isinstance(value, set):
+    return frozenset(value)
+  return value
+
+class MemoCache(object):
+  def __init__(self, maxsize = 4096):
+    self.maxsize = maxsize
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def lookup(self, key, compute):
+    value = self.entries.get(key, self)
+    if value is not self:
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return value
+    self.misses += 1
+    value = compute()
+    self.entries[key] = value
+    if len(self.entries) > self.maxsize:
+      self.entries.popitem(last = False)
+    return value
+
+  def clear(self):
+    self.entries.clear()
+
+def memoize(method):
+  #Cache toolchain method results in the toolchain memo cache, keyed on the method
+  #name and arguments. Lists are copied on return so callers can extend them freely
+  name = method.__name__
+  def memoized(self, *args):
+    key = (name,) + freeze(args)
+    try:
+      hash(key)
+    except TypeError:
+      return method(self, *args)
+    result = self.memo.lookup(key, lambda: method(self, *args))
+    if isinstance(result, list):
+      return list(result)
+    return result
+  memoized.__name__ = name
+  memoized.__doc__ = method.__doc__
+  return memoized
+
+class SliceState(object):
+  #Generation state for one config and arch slice of a writer, carried across build_sources
+  #calls and handed to pool workers so slices can be generated independently
+  def __init__(self, sliceid):
+    self.sliceid = sliceid
+    self.path_variables = {}
+    self.rule_variants = {}
+    self.rule_variant_names = set()
+    self.precompiled = {}
+
+class BuildOutputs(collections.abc.Mapping):
+  #Read-only mapping of config to the list of output paths built for it, returned by
+  #lib, sharedlib and bin. Outputs are kept as interned strings in per config tuples
+  __slots__ = ('configs', 'outputs')
+
+  def __init__(self, built):
+    self.configs = tuple(built.keys())
+    self.outputs = tuple([tuple([sys.intern(path) for path in built[config]]) for config in self.configs])
+
+  def __getitem__(self, config):
+    try:
+      return list(self.outputs[self.configs.index(config)])
+    except ValueError:
+      raise KeyError(config)
+
+  def __iter__(self):
+    return iter(self.configs)
+
+  def __len__(self):
+    return len(self.configs)
+
+  def __repr__(self):
+    return 'BuildOutputs(' + repr(dict(self.items())) + ')'
+
+class DeferredOutputs(collections.abc.Mapping):
+  #Outputs of a module skipped by module selection. The module is generated the first
+  #time it is required, either as a dependency or when its outputs are accessed
+  __slots__ = ('toolchain', 'arguments', 'outputs')
+
+  def __init__(self, toolchain, arguments):
+    self.toolchain = toolchain
+    self.arguments = arguments
+    self.outputs = None
+
+  def resolve(self):
+    if self.outputs is None:
+      self.outputs = self.toolchain.generate_sources(*self.arguments)
+      self.arguments = None
+    return self.outputs
+
+  def __getitem__(self, config):
+    return self.resolve()[config]
+
+  def __iter__(self):
+    return iter(self.resolve())
+
+  def __len__(self):
+    return len(self.resolve())
+
+#Toolchain used by forked slice generation workers
+pool_toolchain = None
+
+def build_slice_task(task):
+  return pool_toolchain.build_slice(*task)
 
 class Toolchain(object):
   def __init__(self, host, target, toolchain):
@@ -64,6 +225,20 @@ class Toolchain(object):
     self.build_lto = False
     self.support_lua = False
     self.internal_deps = False
+    self.specialize_rules = False
+    self.launcher = ''
+    self.remote_jobs = 0
+    self.link_jobs = 0
+    self.objcache = False
+    self.objcache_dir = ''
+    self.objcache_size = 2048
+    self.objcache_backend = ''
+    self.prefix_map = False
+    self.build_unity = False
+    self.unity_files = 32
+    self.unity_bytes = 256 * 1024
+    self.jobs = 1
+    self.only_modules = None
     self.python = 'python'
     self.objext = '.o'
     if target.is_windows():
@@ -96,6 +271,10 @@ class Toolchain(object):
     #Dependency paths
     self.depend_includepaths = []
     self.depend_libpaths = []
+    self.depend_paths = collections.OrderedDict()
+
+    #Cache of host queries made while setting up the toolchain
+    self.probes = probe.ProbeCache(os.path.join(self.buildpath, 'probes.json'), self.build_prefs_files)
 
     #Target helpers
     self.android = None
@@ -122,12 +301,58 @@ class Toolchain(object):
     #Builders
     self.builders = {}
 
+    #Per config and arch writer callback, None to write everything through the given writer
+    self.slice_writer = None
+
+    #Per writer, config and arch slice state, and the state of slice buffers being generated
+    self.slice_states = {}
+    self.writer_states = {}
+
+    #Generated module paths mapped to the module they were generated for
+    self.module_paths = {}
+
+    #Directory nodes created by mkdir
+    self.created_directories = {}
+
+    #Worker pool for parallel slice generation
+    self.pool = None
+
+    #Modules skipped by module selection, and selected dependencies not yet declared, by output file
+    self.deferred_modules = {}
+    self.required_modules = set()
+
+    #Sources generated by configure, like unity translation units
+    self.generated_files = []
+
+    #Sources listed by modules which are generated in the build directory, by listed path
+    self.generated_sources = {}
+
+    #Objects with the volatile version fields linked into final binaries, by config and arch
+    self.version_objects = {}
+
+    #Phony alias targets and the aliases built by default
+    self.module_aliases = collections.OrderedDict()
+    self.shared_aliases = collections.OrderedDict()
+    self.defaults = []
+
+    #Cache for flag and path builders
+    self.memo = MemoCache()
+
+  def initialize_variant(self, variant):
+    #Separate output directories for builds of a target with different toolchains or options
+    self.buildpath = os.path.join('build', 'ninja', self.target.platform + '-' + variant)
+    self.libpath = os.path.join('lib', self.target.platform + '-' + variant)
+    self.binpath = os.path.join('bin', self.target.platform + '-' + variant)
+    self.probes.filename = os.path.join(self.buildpath, 'probes.json')
+
   def initialize_subninja(self, path):
     self.subninja = path
 
   def initialize_project(self, project):
     self.project = project
-    version.generate_version(self.project, self.project)
+    #The version.c listed in the project directory is generated in the build directory
+    #by the version edge, per variant and without touching the source tree
+    self.generated_sources[os.path.join(self.subninja, self.project, 'version.c')] = self.version_source()
 
   def initialize_archs(self, archs):
     self.archs = list(archs)
@@ -138,7 +363,7 @@ class Toolchain(object):
     if self.target.is_windows():
       self.archs = ['x86-64']
     elif self.target.is_linux() or self.target.is_bsd() or self.target.is_sunos() or self.target.is_haiku():
-      localarch = subprocess.check_output(['uname', '-m']).decode().strip()
+      localarch = self.probes.check_output(['uname', '-m'])
       if localarch == 'x86_64' or localarch == 'amd64':
         self.archs = ['x86-64']
       elif localarch == 'i686':
@@ -191,11 +416,20 @@ class Toolchain(object):
         print("Unable to locate dependent lib: " + lib)
         sys.exit(-1)
       else:
+        self.depend_paths[lib] = includepath
         self.depend_includepaths += [includepath]
         if self.subninja == '':
           self.depend_libpaths += [libpath]
 
+  def probe_commands(self):
+    #Host queries the toolchain will make in build_toolchain, run concurrently up front
+    commands = []
+    if self.xcode != None:
+      commands += self.xcode.probe_commands()
+    return commands
+
   def build_toolchain(self):
+    self.probes.prefetch(self.probe_commands())
     if self.android != None:
       self.android.build_toolchain()
     if self.xcode != None:
@@ -219,14 +453,48 @@ class Toolchain(object):
         self.support_lua = get_boolean_flag(val)
       elif key == 'internal_deps':
         self.internal_deps = get_boolean_flag(val)
+      elif key == 'specialize_rules':
+        self.specialize_rules = get_boolean_flag(val)
+      elif key == 'launcher':
+        self.launcher = val
+      elif key == 'remote_jobs':
+        self.remote_jobs = int(val)
+      elif key == 'link_jobs':
+        self.link_jobs = int(val)
+      elif key == 'objcache':
+        self.objcache = get_boolean_flag(val)
+      elif key == 'objcache_dir':
+        self.objcache_dir = val
+      elif key == 'objcache_size':
+        self.objcache_size = int(val)
+      elif key == 'objcache_backend':
+        self.objcache_backend = val
+      elif key == 'prefix_map':
+        self.prefix_map = get_boolean_flag(val)
+      elif key == 'unity':
+        self.build_unity = get_boolean_flag(val)
+      elif key == 'unity_files':
+        self.unity_files = int(val)
+      elif key == 'unity_bytes':
+        self.unity_bytes = int(val)
+      elif key == 'jobs':
+        self.jobs = int(val)
+      elif key == 'default':
+        self.defaults = get_name_list(val)
+      elif key == 'only':
+        self.only_modules = set(get_name_list(val)) or None
     if self.xcode != None:
       self.xcode.parse_default_variables(variables)
 
-  def read_build_prefs(self):
-    self.read_prefs('build.json')
-    self.read_prefs(os.path.join('build', 'ninja', 'build.json'))
+  def build_prefs_files(self):
+    prefsfiles = ['build.json', os.path.join('build', 'ninja', 'build.json')]
     if self.buildprefs != '':
-      self.read_prefs(self.buildprefs)
+      prefsfiles += [self.buildprefs]
+    return prefsfiles
+
+  def read_build_prefs(self):
+    for prefsfile in self.build_prefs_files():
+      self.read_prefs(prefsfile)
 
   def read_prefs(self, filename):
     if not os.path.isfile( filename ):
@@ -245,6 +513,34 @@ class Toolchain(object):
       self.build_lto = get_boolean_flag( prefs['lto'] )
     if 'support_lua' in prefs:
       self.support_lua = get_boolean_flag(prefs['support_lua'])
+    if 'specialize_rules' in prefs:
+      self.specialize_rules = get_boolean_flag(prefs['specialize_rules'])
+    if 'launcher' in prefs:
+      self.launcher = prefs['launcher']
+    if 'remote_jobs' in prefs:
+      self.remote_jobs = int(prefs['remote_jobs'])
+    if 'link_jobs' in prefs:
+      self.link_jobs = int(prefs['link_jobs'])
+    if 'objcache' in prefs:
+      self.objcache = get_boolean_flag(prefs['objcache'])
+    if 'objcache_dir' in prefs:
+      self.objcache_dir = prefs['objcache_dir']
+    if 'objcache_size' in prefs:
+      self.objcache_size = int(prefs['objcache_size'])
+    if 'objcache_backend' in prefs:
+      self.objcache_backend = prefs['objcache_backend']
+    if 'prefix_map' in prefs:
+      self.prefix_map = get_boolean_flag(prefs['prefix_map'])
+    if 'unity' in prefs:
+      self.build_unity = get_boolean_flag(prefs['unity'])
+    if 'unity_files' in prefs:
+      self.unity_files = int(prefs['unity_files'])
+    if 'unity_bytes' in prefs:
+      self.unity_bytes = int(prefs['unity_bytes'])
+    if 'jobs' in prefs:
+      self.jobs = int(prefs['jobs'])
+    if 'default' in prefs:
+      self.defaults = get_name_list(prefs['default'])
     if 'python' in prefs:
       self.python = prefs['python']
     if self.android != None:
@@ -270,8 +566,84 @@ class Toolchain(object):
   def use_lto(self):
     return self.build_lto
 
+  def use_unity(self, variables = None):
+    if variables and 'unity' in variables:
+      return get_boolean_flag(variables['unity'])
+    return self.build_unity
+
+  def compile_pool(self):
+    #Compiles run in a pool deeper than the local cores when distributed by the launcher
+    if self.remote_jobs > 0 or os.path.basename(self.launcher) in remote_launchers:
+      return 'remote_compile'
+    return None
+
+  def link_pool(self):
+    #Keeps links to the local cores when ninja runs with a job count sized for remote compiles
+    if self.compile_pool() is not None:
+      return 'local_link'
+    return None
+
+  def compile_launcher(self):
+    #Command prefixed to the compiler in compile rules only
+    return self.launcher
+
+  def objcache_launcher(self):
+    #Object cache wrapper, with the size limit given in MiB
+    command = self.python + ' ' + os.path.join('build', 'ninja', 'objcache.py')
+    command += ' --dir ' + (self.objcache_dir or os.path.join(self.buildpath, 'objcache'))
+    command += ' --max-size ' + str(self.objcache_size * 1024 * 1024)
+    if self.objcache_backend:
+      command += ' --backend ' + self.objcache_backend
+    command += ' --'
+    if self.launcher:
+      command += ' ' + self.launcher
+    return command
+
+  def prefix_map_roots(self):
+    #Absolute roots mapped to relative paths, the more specific build root last as
+    #gcc applies the last matching map and clang the longest matching one
+    sourceroot = os.getcwd()
+    sourceroots = [sourceroot, os.path.realpath(sourceroot)]
+    if os.environ.get('PWD') and os.path.realpath(os.environ['PWD']) == os.path.realpath(sourceroot):
+      sourceroots += [os.environ['PWD']]
+    roots = []
+    for root in sourceroots:
+      if not (root, '.') in roots:
+        roots += [(root, '.')]
+    #A build directory linked from elsewhere is mapped to its path in the source tree
+    buildroot = os.path.realpath(self.buildpath)
+    if not buildroot.startswith(os.path.realpath(sourceroot) + os.sep):
+      roots += [(buildroot, self.buildpath)]
+    return roots
+
+  def prefix_map_flags(self):
+    #Compiler flags removing the source and build roots from objects, for clang and gcc
+    flags = []
+    for root, path in self.prefix_map_roots():
+      flags += ['-fdebug-prefix-map=' + root + '=' + path, '-fmacro-prefix-map=' + root + '=' + path, '-ffile-prefix-map=' + root + '=' + path]
+    return flags
+
+  def normalize_includepath(self, path):
+    #Include paths below the source root are given relative to it, without redundant components
+    if os.path.isabs(path):
+      for root, mapped in self.prefix_map_roots():
+        if path == root or path.startswith(root + os.sep):
+          return os.path.normpath(os.path.join(mapped, os.path.relpath(path, root)))
+      return path
+    return os.path.normpath(os.path.join(self.subninja, path))
+
+  def write_compiler_variable(self, writer, key, command):
+    #Environment assignments go in a separate variable ahead of the launcher in compile rules
+    environment, command = split_environment(command)
+    if environment:
+      writer.variable(key + 'env', environment + '$ ')
+    writer.variable(key, command)
+
   def write_variables(self, writer):
     writer.variable('buildpath', self.buildpath)
+    launcher = self.compile_launcher()
+    if launcher:
+      writer.variable('launcher', syntax.escape(launcher) + '$ ')
     writer.variable('target', self.target.platform)
     writer.variable('config', '')
     if self.android != None:
@@ -281,13 +653,50 @@ class Toolchain(object):
 
   def write_rules(self, writer):
     writer.pool('serial_pool', 1)
+    if self.compile_pool() is not None:
+      cores = os.cpu_count() or 1
+      writer.pool('remote_compile', self.remote_jobs if self.remote_jobs > 0 else cores * 4)
+      writer.pool('local_link', self.link_jobs if self.link_jobs > 0 else cores)
     writer.rule('copy', command = self.copycmd('$in', '$out'), description = 'COPY $in -> $out')
     writer.rule('mkdir', command = self.mkdircmd('$out'), description = 'MKDIR $out')
+    writer.rule('version', command = self.python + ' ' + os.path.join('build', 'ninja', 'version.py') + ' $project $outpath --buildsource $buildsource --depfile $depfile --repository $repository',
+                depfile = '$depfile', restat = True, description = 'VERSION $project')
     if self.android != None:
       self.android.write_rules(writer)
     if self.xcode != None:
       self.xcode.write_rules(writer)
 
+  def version_source(self):
+    return os.path.join(self.buildpath, 'version', self.project, 'version.c')
+
+  def version_buildsource(self):
+    return os.path.join(self.buildpath, 'version', self.project + '-version.c')
+
+  def write_version(self, writer):
+    #Regenerate the version sources when the repository state changes. Outputs left
+    #unchanged by a commit are restat, so only the version object and final binaries relink
+    if not self.project:
+      return
+    source = self.version_source()
+    buildsource = self.version_buildsource()
+    writer.build([source, buildsource], 'version', implicit = [os.path.join('build', 'ninja', 'version.py')],
+                 variables = [('project', self.project), ('outpath', os.path.dirname(source)), ('buildsource', buildsource),
+                              ('depfile', buildsource + '.d'), ('repository', self.subninja or '.')])
+    writer.newline()
+
+  def version_object(self, writer, config, arch):
+    if not self.project:
+      return []
+    key = (config, arch)
+    if key not in self.version_objects:
+      #Compiled with the slice state of the modules, sharing their specialized rules
+      outfile = os.path.join('$buildpath', config, arch, 'version', self.project + '-version' + self.objext)
+      slicegraph = self.open_slice(writer.width, self.slice_state(writer, config, arch))
+      self.version_objects[key] = self.compile_file(slicegraph, config, arch, 'sharedlib', self.version_buildsource(), outfile, {})
+      self.writer_states.pop(slicegraph)
+      self.arch_writer(writer, config, arch).append(slicegraph)
+    return self.version_objects[key]
+
   def cdcmd(self):
     return self.cdcmd
 
@@ -300,17 +709,22 @@ class Toolchain(object):
         return
     while path.endswith('/') or path.endswith('\\'):
       path = path[:-1]
-    if path in created_directories:
-      return created_directories[path]
+    if path in self.created_directories:
+      return self.created_directories[path]
     if build_all:
       head_tail = os.path.split(path)
       if len(head_tail[0]):
         subcmd = self.mkdir(writer, head_tail[0], implicit, order_only, build_all)
         implicit = writer._as_list(implicit) + writer._as_list(subcmd)
     cmd = writer.build(path, 'mkdir', None, implicit = implicit, order_only = order_only)
-    created_directories[path] = cmd
+    self.created_directories[path] = cmd
     return cmd
 
+  def arch_writer(self, writer, config, arch):
+    if self.slice_writer is None:
+      return writer
+    return self.slice_writer(config, arch)
+
   def copy(self, writer, src, dst, implicit = None, order_only = None):
     return writer.build(dst, 'copy', src, implicit = implicit, order_only = order_only)
 
@@ -319,6 +733,7 @@ class Toolchain(object):
     for file in infiles:
       path, targetfile = os.path.split(file)
       archpath = outpath
+      copywriter = writer
       #Find which arch we are copying from and append to target path
       #unless on generic arch targets, then re-add if not self.target.is_generic():
       for arch in archs:
@@ -326,13 +741,14 @@ class Toolchain(object):
         while remainpath != '':
           if subdir == arch:
             archpath = os.path.join(outpath, arch)
+            copywriter = self.arch_writer(writer, config, arch)
             break
           remainpath, subdir = os.path.split(remainpath)
         if remainpath != '':
           break
       targetpath = os.path.join(archpath, targetfile)
       if os.path.normpath(file) != os.path.normpath(targetpath):
-        output += self.copy(writer, file, targetpath)
+        output += self.copy(copywriter, file, targetpath)
     return output
 
   def path_escape(self, path):
@@ -344,6 +760,8 @@ class Toolchain(object):
     return [path.replace('\\', '/') for path in paths]
 
   def prefix_includepath(self, path):
+    if self.prefix_map:
+      return self.normalize_includepath(path)
     if os.path.isabs(path) or self.subninja == '':
       return path
     if path == '.':
@@ -364,9 +782,12 @@ class Toolchain(object):
   def implicit_deps(self, config, variables):
     if variables == None:
       return None
+    deps = None
     if 'implicit_deps' in variables:
-      return self.list_per_config(variables['implicit_deps'], config)
-    return None
+      deps = self.list_per_config(variables['implicit_deps'], config)
+    if variables.get('pchdeps'):
+      deps = list(deps or []) + variables['pchdeps']
+    return deps
 
   def make_implicit_deps(self, outpath, arch, config, dependlibs):
     deps = {}
@@ -379,6 +800,201 @@ class Toolchain(object):
       deps[config] += [finalpath]
     return [deps]
 
+  def compile_rule(self, writer, rule, command, description, config, arch, variables):
+    #Fold the per-edge variables into a rule specialized for this set of values, giving
+    #identical command lines without repeating the bindings on every compile edge
+    if not self.specialize_rules or not variables:
+      return rule, variables
+    values = {}
+    for key, val in variables:
+      if isinstance(val, list):
+        val = ' '.join(filter(None, val))
+      values[key] = val
+    variant = (rule, tuple(sorted(values.items())))
+    state = self.writer_state(writer, config, arch)
+    if variant in state.rule_variants:
+      return state.rule_variants[variant], None
+    name = rule + '_' + config + '_' + arch
+    index = 1
+    while name in state.rule_variant_names:
+      index += 1
+      name = rule + '_' + config + '_' + arch + '_' + str(index)
+    state.rule_variant_names.add(name)
+    state.rule_variants[variant] = name
+    def expand(match):
+      if match.group(1) in values:
+        return values[match.group(1)]
+      return match.group(0)
+    writer.rule(name, command = re.sub(r'\$\$|\$([a-zA-Z0-9_-]+)', expand, command), depfile = self.ccdepfile, deps = self.ccdeps, pool = self.compile_pool(), description = description)
+    return name, None
+
+  def memo_statistics(self):
+    return {'hits': self.memo.hits, 'misses': self.memo.misses, 'entries': len(self.memo.entries)}
+
+  def make_modulepath(self, pathprefix, binfile, nodetype):
+    source = self.subninja + pathprefix + binfile
+    decoratedmodule = pathprefix[:-1] + make_pathhash(source, nodetype)
+    if self.module_paths.setdefault(decoratedmodule, (source, nodetype)) != (source, nodetype):
+      decoratedmodule = pathprefix[:-1] + make_longpathhash(source, nodetype)
+      if self.module_paths.setdefault(decoratedmodule, (source, nodetype)) != (source, nodetype):
+        raise Exception('Module path collision for ' + source + ': ' + decoratedmodule)
+    return decoratedmodule
+
+  def make_objectname(self, name, infile, nodetype, objectnames):
+    basename = os.path.splitext(os.path.basename(name))[0]
+    objname = basename + make_pathhash(infile, nodetype) + self.objext
+    if objectnames.setdefault(objname, infile) != infile:
+      objname = basename + make_longpathhash(infile, nodetype) + self.objext
+      if objectnames.setdefault(objname, infile) != infile:
+        raise Exception('Object path collision for ' + infile + ': ' + objname)
+    return objname
+
+  def slice_state(self, writer, config, arch):
+    key = (writer, config, arch)
+    if not key in self.slice_states:
+      self.slice_states[key] = SliceState(len(self.slice_states) + 1)
+    return self.slice_states[key]
+
+  def writer_state(self, writer, config, arch):
+    if writer in self.writer_states:
+      return self.writer_states[writer]
+    return self.slice_state(writer, config, arch)
+
+  def intern_path(self, writer, path):
+    #Note a path prefix repeated across the edges of a module, replaced by a short variable
+    #when the slice is finished if that makes the build file smaller
+    if path:
+      writer.note_prefix(path)
+    return path
+
+  def intern_paths(self, writer):
+    #Names are unique per slice since partitioned build files do not see each others variables
+    state = self.writer_states[writer]
+    definitions = []
+    replacements = {}
+    prefixes = writer.prefix_uses()
+    for path in sorted(prefixes, key = len, reverse = True):
+      uses = prefixes[path]
+      if not uses:
+        continue
+      reference = state.path_variables.get(path)
+      if reference is None:
+        name = 'p' + str(state.sliceid) + '_' + str(len(state.path_variables) + 1)
+        value = syntax.escape_path(path)
+        if uses * (len(path) - len(name) - 1) <= len(name) + len(value) + 4:
+          continue
+        definitions += [(name, value)]
+        reference = '$' + name
+        state.path_variables[path] = reference
+      replacements[path] = reference
+    writer.replace_prefixes(replacements)
+    for name, value in reversed(definitions):
+      writer.define(name, value)
+
+  def open_slice(self, width, state):
+    writer = graph.Graph(width)
+    self.writer_states[writer] = state
+    return writer
+
+  def slice_object(self, writer, config, arch, nodetype, sourceobject, sourcepath, modulepath, sourcevariables):
+    infile, name, objname = sourceobject
+    objs = []
+    if 'pchheader' in sourcevariables:
+      objs, sourcevariables = self.slice_precompiled_header(writer, config, arch, nodetype, infile, modulepath, sourcevariables)
+    if name is not None:
+      infile = os.path.join(self.intern_path(writer, sourcepath), name)
+    outfile = os.path.join(self.intern_path(writer, modulepath), objname)
+    return objs + self.compile_file(writer, config, arch, nodetype, infile, outfile, sourcevariables)
+
+  def slice_precompiled_header(self, writer, config, arch, nodetype, infile, modulepath, sourcevariables):
+    #Precompile the module header for the language of the source on first use in the slice,
+    #returning objects to link from the header edge and the variables compiling the source
+    kind = source_kinds.get(os.path.splitext(infile)[1][1:])
+    if kind is None or not kind in self.builders:
+      return [], sourcevariables
+    precompiled = self.writer_state(writer, config, arch).precompiled
+    key = (modulepath, kind)
+    objs = []
+    if not key in precompiled:
+      precompiled[key] = self.precompile_header(writer, config, arch, nodetype, kind, sourcevariables['pchheader'], self.intern_path(writer, modulepath), sourcevariables)
+      if precompiled[key] is not None:
+        objs = precompiled[key][2]
+    if precompiled[key] is None:
+      return objs, sourcevariables
+    sourcevariables = dict(sourcevariables)
+    sourcevariables['pchdeps'] = precompiled[key][0]
+    sourcevariables['pchflags'] = precompiled[key][1]
+    return objs, sourcevariables
+
+  def precompiled_header_source(self, header, decoratedmodule):
+    #Header given as input to the precompiled header edges of a module
+    return header
+
+  def precompile_header(self, writer, config, arch, targettype, kind, header, modulepath, variables):
+    #Build a precompiled header for sources of the given kind, returning a tuple of the outputs
+    #compile edges depend on, the flags using it and objects to link, or None if not supported
+    return None
+
+  def finish_slice(self, writer, nodetype, config, arch, binfile, objs, modulepath, nodevariables, newline):
+    #Build arch node (per-config-and-arch binary)
+    archoutpath = os.path.join(modulepath, binfile)
+    archnodes = self.compile_node(writer, nodetype, config, arch, objs + nodevariables.get('linkobjects', []), archoutpath, nodevariables)
+    if newline:
+      writer.newline()
+    self.intern_paths(writer)
+    state = self.writer_states.pop(writer)
+    return writer, archnodes, state
+
+  def build_slice(self, width, state, nodetype, config, arch, binfile, objects, sourcepath, modulepath, sourcevariables, nodevariables, newline):
+    #Generate the compile edges and arch node for one config and arch into a separate graph
+    writer = self.open_slice(width, state)
+    objs = []
+    for sourceobject in objects:
+      objs += self.slice_object(writer, config, arch, nodetype, sourceobject, sourcepath, modulepath, sourcevariables)
+    return self.finish_slice(writer, nodetype, config, arch, binfile, objs, modulepath, nodevariables, newline)
+
+  def stream_slices(self, tasks, objects):
+    #Generate all slices in a single pass over the source objects, so sources can be
+    #consumed lazily without keeping the resolved list around
+    slices = [(self.open_slice(task[0], task[1]), [], task) for task in tasks]
+    for sourceobject in objects:
+      for writer, sliceobjs, task in slices:
+        sliceobjs += self.slice_object(writer, task[3], task[4], task[2], sourceobject, task[6], task[7], task[8])
+    #Finished slices are yielded one at a time and not referenced here afterwards, so each
+    #is released once the caller has appended it
+    while slices:
+      writer, sliceobjs, task = slices.pop(0)
+      yield self.finish_slice(writer, task[2], task[3], task[4], task[5], sliceobjs, task[7], task[9], task[10])
+
+  def slice_pool(self, count):
+    #Worker pool for generating count slices in parallel, None to generate them in this process
+    if self.jobs <= 1 or count <= 1:
+      return None
+    if self.pool is None:
+      import multiprocessing
+      try:
+        context = multiprocessing.get_context('fork')
+      except ValueError:
+        return None
+      global pool_toolchain
+      pool_toolchain = self
+      self.pool = context.Pool(self.jobs)
+    return self.pool
+
+  def build_slices(self, tasks, objects):
+    pool = self.slice_pool(len(tasks))
+    if pool is None:
+      return self.stream_slices(tasks, objects)
+    #Forked workers need the complete list of source objects
+    objects = list(objects)
+    return pool.imap(build_slice_task, [task[:6] + (objects,) + task[6:] for task in tasks])
+
+  def close_pool(self):
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+
   def compile_file(self, writer, config, arch, targettype, infile, outfile, variables):
     extension = os.path.splitext(infile)[1][1:]
     if extension in self.builders:
@@ -390,13 +1006,43 @@ class Toolchain(object):
       return self.builders[nodetype](writer, config, arch, nodetype, infiles, outfile, variables)
     return []
 
+  def is_module_selected(self, module, binfile):
+    if self.only_modules is None or module in self.only_modules:
+      return True
+    names = [self.libprefix + name + self.staticlibext for name in self.only_modules]
+    names += [self.libprefix + name + self.dynamiclibext for name in self.only_modules]
+    names += [self.binprefix + name + self.binext for name in self.only_modules]
+    return binfile in names
+
+  def require_modules(self, dependlibs, implicit_deps):
+    #Generate the deferred modules a selected module depends on, remembering dependent
+    #libs not yet declared so they are generated when they are
+    for lib in dependlibs or []:
+      for binfile in [self.libprefix + lib + self.staticlibext, self.libprefix + lib + self.dynamiclibext]:
+        if binfile in self.deferred_modules:
+          self.deferred_modules.pop(binfile).resolve()
+        else:
+          self.required_modules.add(binfile)
+    for deps in implicit_deps or []:
+      if isinstance(deps, DeferredOutputs):
+        deps.resolve()
+
   def build_sources(self, writer, nodetype, multitype, module, sources, binfile, basepath, outpath, configs, includepaths, libpaths, dependlibs, libs, implicit_deps, variables, frameworks):
+    arguments = (writer, nodetype, multitype, module, sources, binfile, basepath, outpath, configs, includepaths, libpaths, dependlibs, libs, implicit_deps, variables, frameworks)
+    if not self.is_module_selected(module, binfile) and binfile not in self.required_modules:
+      deferred = DeferredOutputs(self, arguments)
+      self.deferred_modules[binfile] = deferred
+      return deferred
+    return self.generate_sources(*arguments)
+
+  def generate_sources(self, writer, nodetype, multitype, module, sources, binfile, basepath, outpath, configs, includepaths, libpaths, dependlibs, libs, implicit_deps, variables, frameworks):
+    self.require_modules(dependlibs, implicit_deps)
     pathprefix = ""
     if basepath != '':
       pathprefix = basepath + "-"
     if module != '':
       pathprefix += module + "-"
-    decoratedmodule = pathprefix[:-1] + make_pathhash(self.subninja + pathprefix + binfile, nodetype)
+    decoratedmodule = self.make_modulepath(pathprefix, binfile, nodetype)
     built = {}
     if includepaths is None:
       includepaths = []
@@ -415,41 +1061,173 @@ class Toolchain(object):
                      'implicit_deps': implicit_deps,
                      'libpaths': self.depend_libpaths + list(libpaths),
                      'frameworks': frameworks})
+    sourcepath = os.path.join(self.subninja, basepath, module)
+    if variables and variables.get('pch'):
+      pchheader = variables['pch']
+      if not os.path.isabs(pchheader):
+        pchheader = os.path.join(sourcepath, pchheader)
+      sourcevariables['pchheader'] = self.precompiled_header_source(pchheader, decoratedmodule)
+    if self.use_unity(variables):
+      objects = self.unity_objects(sources, basepath, module, nodetype, sourcepath, decoratedmodule, variables)
+    else:
+      objects = self.source_objects(sources, basepath, module, nodetype, sourcepath)
     self.module = module
     self.buildtarget = binfile
+    #Generate all config and arch slices, possibly in parallel, then merge them in order
+    tasks = []
     for config in configs:
-      archnodes = []
-      built[config] = []
       for arch in self.archs:
-        objs = []
         modulepath = os.path.join('$buildpath', config, arch, decoratedmodule)
-        sourcevariables['modulepath'] = modulepath
-        nodevariables['modulepath'] = modulepath
+        slicesourcevariables = dict(sourcevariables)
+        slicesourcevariables['modulepath'] = modulepath
+        slicenodevariables = dict(nodevariables)
+        slicenodevariables['modulepath'] = modulepath
         #Make per-arch-and-config list of final implicit deps, including dependent libs
         if self.internal_deps and dependlibs != None:
           dep_implicit_deps = []
           if implicit_deps:
             dep_implicit_deps += implicit_deps
           dep_implicit_deps += self.make_implicit_deps(outpath, arch, config, dependlibs)
-          nodevariables['implicit_deps'] = dep_implicit_deps
-        #Compile all sources
-        for name in sources:
-          if os.path.isabs(name):
-            infile = name
-            outfile = os.path.join(modulepath, os.path.splitext(os.path.basename(name))[0] + make_pathhash(infile, nodetype) + self.objext)
-          else:
-            infile = os.path.join(basepath, module, name)
-            outfile = os.path.join(modulepath, os.path.splitext(os.path.basename(name))[0] + make_pathhash(infile, nodetype) + self.objext)
-            if self.subninja != '':
-              infile = os.path.join(self.subninja, infile)
-          objs += self.compile_file(writer, config, arch, nodetype, infile, outfile, sourcevariables)
-        #Build arch node (per-config-and-arch binary)
-        archoutpath = os.path.join(modulepath, binfile)
-        archnodes += self.compile_node(writer, nodetype, config, arch, objs, archoutpath, nodevariables)
+          slicenodevariables['implicit_deps'] = dep_implicit_deps
+        if nodetype == 'bin' or nodetype == 'sharedlib':
+          slicenodevariables['linkobjects'] = self.version_object(writer, config, arch)
+        state = self.slice_state(writer, config, arch)
+        tasks += [(writer.width, state, nodetype, config, arch, binfile, sourcepath, modulepath, slicesourcevariables, slicenodevariables, self.slice_writer is not None)]
+    #Slices are appended, and so written out when streaming, as they are finished
+    results = iter(self.build_slices(tasks, objects))
+    for config in configs:
+      archnodes = []
+      nodesbyarch = []
+      built[config] = []
+      for arch in self.archs:
+        slicegraph, nodes, state = next(results)
+        self.slice_states[(writer, config, arch)] = state
+        self.arch_writer(writer, config, arch).append(slicegraph)
+        archnodes += nodes
+        nodesbyarch += [(arch, nodes)]
       #Build final config node (per-config binary)
       built[config] += self.compile_node(writer, multitype, config, self.archs, archnodes, os.path.join(outpath, config), None)
+      self.add_aliases(module, config, built[config])
+      for arch, nodes in nodesbyarch:
+        #Per arch copies of the final node if there are any, otherwise the arch node itself
+        archoutputs = [path for path in built[config] if arch in path.replace('\\', '/').split('/')]
+        self.add_alias(arch + '-' + config, archoutputs or nodes, True)
     writer.newline()
-    return built
+    return BuildOutputs(built)
+
+  def add_alias(self, name, outputs, shared = False):
+    #Shared aliases, like the per config ones, collect outputs across modules and are only
+    #written by the top level build, as subninja parts can not define the same target
+    aliases = self.shared_aliases if shared else self.module_aliases
+    aliases.setdefault(name, []).extend(outputs)
+
+  def add_aliases(self, module, config, outputs):
+    if module != '':
+      self.add_alias(module, outputs)
+      self.add_alias(module + '-' + config, outputs)
+    self.add_alias(config, outputs, True)
+
+  def default_targets(self):
+    targets = []
+    for name in self.defaults:
+      if name == 'native':
+        #Host architecture in the first configured of debug or the first config
+        localarch = self.archs[0]
+        if self.host.platform == self.target.platform and not self.target.is_windows():
+          machine = self.probes.check_output(['uname', '-m'])
+          localarch = {'x86_64': 'x86-64', 'amd64': 'x86-64', 'i686': 'x86', 'aarch64': 'arm64'}.get(machine, machine)
+        config = 'debug' if 'debug' in self.configs else self.configs[0]
+        name = localarch + '-' + config
+      if name in self.module_aliases or (self.subninja == '' and name in self.shared_aliases):
+        targets += [name]
+    return targets
+
+  def write_aliases(self, writer):
+    aliases = list(self.module_aliases.items())
+    if self.subninja == '':
+      aliases += [(name, outputs) for name, outputs in self.shared_aliases.items() if name not in self.module_aliases]
+    if not aliases:
+      return
+    writer.comment('Aliases')
+    for name, outputs in aliases:
+      writer.build(name, 'phony', list(collections.OrderedDict.fromkeys(outputs)))
+    defaults = self.default_targets()
+    if defaults:
+      writer.default(defaults)
+    writer.newline()
+
+  def source_objects(self, sources, basepath, module, nodetype, sourcepath):
+    #Resolve input files and object names as sources are consumed, yielding a
+    #(infile, name, objname) tuple with name set when infile is relative to sourcepath
+    objectnames = {}
+    for name in sources:
+      if os.path.isabs(name):
+        infile = name
+        yield (infile, None, self.make_objectname(name, infile, nodetype, objectnames))
+      else:
+        infile = os.path.join(basepath, module, name)
+        objname = self.make_objectname(name, infile, nodetype, objectnames)
+        if self.subninja != '':
+          infile = os.path.join(self.subninja, infile)
+        if infile in self.generated_sources:
+          yield (self.generated_sources[infile], None, objname)
+        elif sourcepath != '':
+          yield (infile, name, objname)
+        else:
+          yield (infile, None, objname)
+
+  def unity_groups(self, sources, basepath, module, variables):
+    #Group sources of the same kind, in order, into units bounded by file count and byte
+    #size. Sources excluded by the unity_exclude patterns or of other kinds are left alone
+    maxfiles = int(variables.get('unity_files', self.unity_files))
+    maxbytes = int(variables.get('unity_bytes', self.unity_bytes))
+    exclude = variables.get('unity_exclude') or []
+    ungrouped = []
+    groups = collections.OrderedDict()
+    for name in sources:
+      kind = source_kinds.get(os.path.splitext(name)[1][1:])
+      if kind is None or not kind in self.builders or any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+        ungrouped += [name]
+        continue
+      infile = name
+      if not os.path.isabs(name):
+        infile = os.path.join(self.subninja, basepath, module, name)
+      if infile in self.generated_sources:
+        ungrouped += [name]
+        continue
+      try:
+        size = os.path.getsize(infile)
+      except OSError:
+        size = 0
+      units = groups.setdefault(kind, [])
+      if not units or len(units[-1][0]) >= maxfiles or (units[-1][0] and units[-1][1] + size > maxbytes):
+        units += [[[], 0]]
+      units[-1][0].append((name, infile))
+      units[-1][1] += size
+    return ungrouped, groups
+
+  def unity_objects(self, sources, basepath, module, nodetype, sourcepath, decoratedmodule, variables):
+    #Write the unity translation units including the grouped sources and yield their objects
+    #after those of the sources compiled on their own. A unit of a single source compiles it directly
+    ungrouped, groups = self.unity_groups(list(sources), basepath, module, variables or {})
+    unitpath = os.path.join(self.buildpath, 'unity', decoratedmodule)
+    units = []
+    for kind, kindunits in groups.items():
+      for index, (unit, _) in enumerate(kindunits):
+        if len(unit) == 1:
+          ungrouped += [unit[0][0]]
+          continue
+        unitfile = os.path.join(unitpath, 'unity-' + kind + '-' + str(index + 1) + '.' + kind)
+        #Paths are relative to the build root, which every compile rule has as include path
+        content = ''.join(['#include "' + infile.replace('\\', '/') + '"\n' for _, infile in unit])
+        write_if_changed(unitfile, content)
+        self.generated_files += [unitfile]
+        units += [unitfile]
+    for sourceobject in self.source_objects(ungrouped, basepath, module, nodetype, sourcepath):
+      yield sourceobject
+    objectnames = {}
+    for unitfile in units:
+      yield (unitfile, None, self.make_objectname(unitfile, unitfile, nodetype, objectnames))
 
   def lib(self, writer, module, sources, libname, basepath, configs, includepaths, variables, outpath = None):
     built = {}
@@ -493,20 +1271,27 @@ class Toolchain(object):
     # Filter out platforms that do not have app concept
     if not (self.target.is_macos() or self.target.is_ios() or self.target.is_android() or self.target.is_tizen()):
       return builtbin
-    if basepath is None:
-      basepath = ''
     if binname is None:
       binname = module
+    if not self.is_module_selected(module, self.binprefix + binname + self.binext):
+      return builtbin
+    if basepath is None:
+      basepath = ''
     if configs is None:
       configs = list(self.configs)
+    #Sources are read once per config and again for java sources
+    sources = list(sources)
     for config in configs:
       archbins = self.bin(writer, module, sources, binname, basepath, [config], includepaths, libpaths, implicit_deps, dependlibs, libs, frameworks, variables, '$buildpath')
+      configbins = []
       if self.target.is_macos() or self.target.is_ios():
         binpath = os.path.join(self.binpath, config, binname + '.app')
-        builtbin += self.xcode.app(self, writer, module, archbins, self.binpath, binname, basepath, config, None, resources, True)
+        configbins += self.xcode.app(self, writer, module, archbins, self.binpath, binname, basepath, config, None, resources, True)
       if self.target.is_android():
         javasources = [name for name in sources if name.endswith('.java')]
-        builtbin += self.android.apk(self, writer, module, archbins, javasources, self.binpath, binname, basepath, config, None, resources)
+        configbins += self.android.apk(self, writer, module, archbins, javasources, self.binpath, binname, basepath, config, None, resources)
+      self.add_aliases(module, config, configbins)
+      builtbin += configbins
       #elif self.target.is_tizen():
       #  builtbin += self.tizen.tpk( writer, config, basepath, module, binname = binname, archbins = archbins, resources = resources )
     return builtbin
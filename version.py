@@ -1,80 +1,170 @@
 #!/usr/bin/env python
 
-"""Version utility"""
+"""Version utility
+
+Generates two sources from git describe. The version.c source compiled into the
+project library only holds the numbers from the version tag and changes when a
+new version is tagged. The build number and SCM revision change with every commit
+and go into a separate source compiled into a small object that is linked into the
+final binaries of the project, so a commit does not rebuild the libraries. The
+library defines weak zero defaults, used by binaries linked without the object.
+"""
 
+import argparse
 import subprocess
 import os
 import sys
 
-def generate_version_string(libname):
+def git_command():
+  if sys.platform.startswith('win'):
+    return 'git.exe'
+  return 'git'
 
+def describe(path = None):
+  """Version numbers, build number and SCM revision from git describe, with defaults
+  if there is no repository or no version tag"""
   version_numbers = []
   tokens = []
-
-  gitcmd = 'git'
-  if sys.platform.startswith('win'):
-    gitcmd = 'git.exe'
   try:
-    git_version = subprocess.check_output( [ gitcmd, 'describe', '--tags', '--long' ], stderr = subprocess.STDOUT ).strip()
+    git_version = subprocess.check_output( [ git_command(), 'describe', '--tags', '--long' ], stderr = subprocess.STDOUT, cwd = path or None ).strip()
     tokens = git_version.decode().split( '-' )
     version_numbers = tokens[0].split( '.' )
   except Exception:
     pass
 
-  version_major = "0"
-  version_minor = "0"
-  version_revision = "1"
-  version_build = "0"
-  version_scm = "0"
+  version = {'major': '0', 'minor': '0', 'revision': '1', 'build': '0', 'scm': '0'}
 
   if version_numbers and len( version_numbers ) > 2:
-    version_major = version_numbers[0]
-    version_minor = version_numbers[1]
-    version_revision = version_numbers[2]
+    version['major'] = version_numbers[0]
+    version['minor'] = version_numbers[1]
+    version['revision'] = version_numbers[2]
 
   if tokens and len( tokens ) > 2:
-    version_build = tokens[1]
-    version_scm = tokens[2][1:]
+    version['build'] = tokens[1]
+    version['scm'] = tokens[2][1:]
+
+  return version
+
+def scm_depends(path = None):
+  """Repository files changed by a commit, checkout or new tag"""
+  try:
+    gitdir = subprocess.check_output( [ git_command(), 'rev-parse', '--git-dir' ], stderr = subprocess.DEVNULL, cwd = path or None ).decode().strip()
+  except Exception:
+    return []
+  gitdir = os.path.join( path or '', gitdir )
+  depends = [ os.path.join( gitdir, 'HEAD' ), os.path.join( gitdir, 'packed-refs' ), os.path.join( gitdir, 'refs', 'tags' ) ]
+  try:
+    with open( os.path.join( gitdir, 'HEAD' ), 'r' ) as head:
+      ref = head.read().strip()
+    if ref.startswith( 'ref: ' ):
+      depends += [ os.path.join( gitdir, *ref[5:].split( '/' ) ) ]
+  except IOError:
+    pass
+  return [ path for path in depends if os.path.exists( path ) ]
+
+def symbol_prefix(libname):
+  return libname + '_version'
+
+def generate_version_string(libname, version = None):
+  if version is None:
+    version = describe()
 
   module = ""
   if not libname == "foundation":
     module = "_module"
 
+  prefix = symbol_prefix(libname)
   source = """/* ****** AUTOMATICALLY GENERATED, DO NOT EDIT ******
    This file is generated from the git describe command.
-   Run the configure script to regenerate this file */
+   Run the configure script or build to regenerate this file */
 
 #include <foundation/version.h>
 #include <""" + libname + "/" + libname + """.h>
 
+/* Build number and SCM revision are defined in a separately generated object
+   linked into the final binaries, defaulting to zero when it is not linked */
+#if defined(_MSC_VER)
+unsigned int """ + prefix + """_build_default = 0;
+unsigned int """ + prefix + """_scm_default = 0;
+#  if defined(_M_IX86)
+#    pragma comment(linker, "/alternatename:_""" + prefix + """_build=_""" + prefix + """_build_default")
+#    pragma comment(linker, "/alternatename:_""" + prefix + """_scm=_""" + prefix + """_scm_default")
+#  else
+#    pragma comment(linker, "/alternatename:""" + prefix + """_build=""" + prefix + """_build_default")
+#    pragma comment(linker, "/alternatename:""" + prefix + """_scm=""" + prefix + """_scm_default")
+#  endif
+extern unsigned int """ + prefix + """_build;
+extern unsigned int """ + prefix + """_scm;
+#else
+/* Not const, as the compiler may fold the value of a weak constant */
+__attribute__((weak)) unsigned int """ + prefix + """_build = 0;
+__attribute__((weak)) unsigned int """ + prefix + """_scm = 0;
+#endif
+
 version_t
 """ + libname + module + """_version(void) {
 """
-  source += "	return version_make(" + version_major + ", " + version_minor + ", " + version_revision + ", " + version_build + ", 0x" + version_scm + ");\n}\n"
+  source += "	return version_make(" + version['major'] + ", " + version['minor'] + ", " + version['revision'] + ", " + prefix + "_build, " + prefix + "_scm);\n}\n"
   return source
 
-def read_version_string(input_path):
+def generate_build_string(libname, version = None):
+  if version is None:
+    version = describe()
+  prefix = symbol_prefix(libname)
+  source = """/* ****** AUTOMATICALLY GENERATED, DO NOT EDIT ******
+   This file is generated from the git describe command by the build */
+
+"""
+  source += "unsigned int " + prefix + "_build = " + version['build'] + ";\n"
+  source += "unsigned int " + prefix + "_scm = 0x" + version['scm'] + ";\n"
+  return source
+
+def read_file(path):
   try:
-    file = open( os.path.join( input_path, 'version.c' ), "r" )
+    file = open( path, "r" )
     str = file.read()
     file.close()
   except IOError:
     str = ""
   return str
 
-def write_version_string(output_path, str):
-  file = open( os.path.join( output_path, 'version.c' ), "w" )
+def write_if_changed(path, str):
+  #Leave an unchanged file untouched so ninja restat skips everything built from it
+  if read_file(path) == str:
+    return
+  directory = os.path.dirname(path)
+  if directory != '' and not os.path.isdir(directory):
+    os.makedirs(directory)
+  file = open( path, "w" )
   file.write( str )
-  file.close
+  file.close()
 
-def generate_version(libname, output_path):
-  generated = generate_version_string(libname)
-  if generated == None:
-    return
-  previous = read_version_string(output_path)
+def read_version_string(input_path):
+  return read_file( os.path.join( input_path, 'version.c' ) )
 
-  if generated != previous:
-    write_version_string(output_path, generated)
+def write_version_string(output_path, str):
+  write_if_changed( os.path.join( output_path, 'version.c' ), str )
+
+def generate_version(libname, output_path, build_path = None, depfile = None, repository = None):
+  #The repository defaults to the one containing the output directory
+  root = repository
+  if root is None:
+    root = os.path.dirname( os.path.normpath( output_path ) )
+  version = describe( root )
+  write_version_string( output_path, generate_version_string( libname, version ) )
+  if build_path:
+    write_if_changed( build_path, generate_build_string( libname, version ) )
+  if depfile:
+    escape = lambda path: path.replace( '\\', '/' ).replace( ' ', '\\ ' )
+    depends = scm_depends( root )
+    write_if_changed( depfile, escape( os.path.join( output_path, 'version.c' ) ) + ': ' + ' '.join( [ escape( path ) for path in depends ] ) + '\n' )
 
 if __name__ == "__main__":
-  generate_version(sys.argv[1], sys.argv[2])
+  parser = argparse.ArgumentParser( description = 'Version source generator for Ninja builds' )
+  parser.add_argument( 'libname', type=str, help = 'Library name' )
+  parser.add_argument( 'output_path', type=str, help = 'Output directory for the library version.c' )
+  parser.add_argument( '--buildsource', type=str, help = 'Output path of the build number and SCM revision source', default = None )
+  parser.add_argument( '--depfile', type=str, help = 'Output path of the depfile listing the repository files read', default = None )
+  parser.add_argument( '--repository', type=str, help = 'Path in the repository to describe', default = None )
+  options = parser.parse_args()
+  generate_version( options.libname, options.output_path, options.buildsource, options.depfile, options.repository )
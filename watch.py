@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""Watch mode for the ninja build generator
+
+Keeps the generator state in memory after configure, polls the source, header,
+prefs and configure script files, and runs ninja for the targets affected by
+each change, followed by the affected test binaries. Configure is rerun in
+process, reusing the probe and directory caches, only when the configure inputs
+change, for example when a globbed directory gains or loses files. A change to
+the generator modules restarts the process.
+"""
+
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+
+#Active watch session, seen by generators created while regenerating
+session = None
+
+def stamp(paths):
+  stamps = {}
+  for path in paths:
+    try:
+      stamps[path] = os.stat(path).st_mtime_ns
+    except OSError:
+      stamps[path] = None
+  return stamps
+
+def changed_paths(previous, current):
+  return [path for path in current if previous.get(path) != current[path]]
+
+class WatchSession(object):
+  def __init__(self, generator, interval = 0.2, ninja = 'ninja'):
+    self.generator = generator
+    self.generators = []
+    self.probes = generator.toolchain.probes
+    self.directories = generator.directories
+    self.interval = interval
+    self.ninja = ninja
+    self.index = None
+
+  def ninja_command(self):
+    return self.generator.ninja_command(self.ninja)
+
+  def configure_inputs(self):
+    generator = self.generator
+    return generator.configure_depends + generator.toolchain.build_prefs_files() + list(generator.directories.scanned)
+
+  def module_inputs(self):
+    return self.generator.generator_modules()
+
+  def build_index(self):
+    self.index = self.generator.graph_index(self.ninja)
+
+  def regenerate(self):
+    global session
+    session = self
+    self.generators = []
+    self.directories.scanned = {}
+    try:
+      runpy.run_path(self.generator.configure_depends[0], run_name = '__main__')
+    except Exception as e:
+      print('Configure failed: ' + str(e))
+      self.discard()
+      return False
+    except SystemExit as e:
+      if e.code not in [None, 0]:
+        print('Configure failed: exit status ' + str(e.code))
+        self.discard()
+        return False
+    finally:
+      session = None
+    for generator in self.generators:
+      generator.close()
+    if self.generators:
+      self.generator = self.generators[0]
+    self.probes.save()
+    self.restat()
+    return True
+
+  def discard(self):
+    for generator in self.generators:
+      generator.discard()
+
+  def restat(self):
+    #Build files left unchanged keep an mtime older than the input that changed, so mark
+    #them current in the ninja log or ninja would run configure again
+    outputs = [filename for _, filename in self.generator.writers] + self.generator.workspace_files
+    for path in outputs:
+      if os.path.isfile(path):
+        os.utime(path)
+    subprocess.call(self.ninja_command() + ['-t', 'restat'] + outputs)
+
+  def build(self, targets = None):
+    command = self.ninja_command() + list(targets or [])
+    print(' '.join(command))
+    sys.stdout.flush()
+    return subprocess.call(command) == 0
+
+  def run_tests(self, tests):
+    for test in tests:
+      if os.path.isfile(test):
+        result = subprocess.call([test])
+        print(('PASS ' if result == 0 else 'FAIL ') + test)
+
+  def run(self):
+    print('Watching for changes, press Ctrl-C to stop')
+    self.build()
+    self.build_index()
+    modules = stamp(self.module_inputs())
+    inputs = stamp(self.configure_inputs())
+    sources = stamp(self.index.sources())
+    try:
+      while True:
+        time.sleep(self.interval)
+        if changed_paths(modules, stamp(modules)):
+          #Generator modules can not be reloaded in place
+          print('Generator changed, restarting')
+          os.execv(sys.executable, [sys.executable] + sys.argv)
+        current = stamp(inputs)
+        if changed_paths(inputs, current):
+          if self.regenerate():
+            self.build()
+          self.build_index()
+          modules = stamp(self.module_inputs())
+          inputs = stamp(self.configure_inputs())
+          sources = stamp(self.index.sources())
+          continue
+        current = stamp(sources)
+        changed = changed_paths(sources, current)
+        if changed:
+          sources = current
+          affected = self.generator.affected(changed, self.index)
+          if self.build(None if affected['full'] else affected['targets']):
+            self.run_tests(affected['tests'])
+          #The build may have discovered new header dependencies
+          self.build_index()
+          sources.update(stamp([path for path in self.index.sources() if path not in sources]))
+    except KeyboardInterrupt:
+      pass
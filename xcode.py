@@ -26,6 +26,13 @@ class XCode(object):
     elif self.target.is_ios():
       self.deploymenttarget = '15.0'
 
+  def probe_commands(self):
+    sdk = 'macosx' if self.target.is_macos() else 'iphoneos'
+    commands = [['xcrun', '--sdk', sdk, '--show-sdk-platform-path']]
+    commands += [['xcrun', '--sdk', sdk, '-f', tool] for tool in ['plutil', 'actool', 'ibtool', 'dsymutil']]
+    commands += [['sw_vers', '-buildVersion']]
+    return commands
+
   def build_toolchain(self):
     if self.target.is_macos():
       sdk = 'macosx'
@@ -34,15 +41,16 @@ class XCode(object):
       sdk = 'iphoneos'
       deploytarget = 'IPHONEOS_DEPLOYMENT_TARGET=' + self.deploymenttarget
 
-    platformpath = toolchain.check_last_output(['xcrun', '--sdk', sdk, '--show-sdk-platform-path'])
+    platformpath = self.toolchain.probes.check_last_output(['xcrun', '--sdk', sdk, '--show-sdk-platform-path'])
     localpath = platformpath + "/Developer/usr/bin:/Applications/Xcode.app/Contents/Developer/usr/bin:/usr/bin:/bin:/usr/sbin:/sbin"
 
-    self.plist = "PATH=" + localpath + " " + toolchain.check_last_output(['xcrun', '--sdk', sdk, '-f', 'plutil'])
-    self.xcassets = "PATH=" + localpath + " " + toolchain.check_last_output(['xcrun', '--sdk', sdk, '-f', 'actool'])
-    self.xib = "PATH=" + localpath + " " + toolchain.check_last_output(['xcrun', '--sdk', sdk, '-f', 'ibtool'])
-    self.dsymutil = "PATH=" + localpath + " " + toolchain.check_last_output(['xcrun', '--sdk', sdk, '-f', 'dsymutil'])
+    self.plist = "PATH=" + localpath + " " + self.toolchain.probes.check_last_output(['xcrun', '--sdk', sdk, '-f', 'plutil'])
+    self.xcassets = "PATH=" + localpath + " " + self.toolchain.probes.check_last_output(['xcrun', '--sdk', sdk, '-f', 'actool'])
+    self.xib = "PATH=" + localpath + " " + self.toolchain.probes.check_last_output(['xcrun', '--sdk', sdk, '-f', 'ibtool'])
+    self.dsymutil = "PATH=" + localpath + " " + self.toolchain.probes.check_last_output(['xcrun', '--sdk', sdk, '-f', 'dsymutil'])
+    self.buildversion = self.toolchain.probes.check_output(['sw_vers', '-buildVersion'])
 
-    self.plistcmd = 'build/ninja/plist.py --exename $exename --prodname $prodname --bundle $bundleidentifier --target $target --deploymenttarget $deploymenttarget --output $outpath $in'
+    self.plistcmd = 'build/ninja/plist.py --exename $exename --prodname $prodname --bundle $bundleidentifier --target $target --deploymenttarget $deploymenttarget --buildversion $buildversion --output $outpath $in'
     if self.target.is_macos():
       self.xcassetscmd = 'mkdir -p $outpath && $xcassets --output-format human-readable-text --output-partial-info-plist $outplist' \
                          ' --app-icon AppIcon --launch-image LaunchImage --platform macosx --minimum-deployment-target ' + self.deploymenttarget + \
@@ -104,6 +112,7 @@ class XCode(object):
     writer.variable('xcassets', self.xcassets)
     writer.variable('xib', self.xib)
     writer.variable('dsymutil', self.dsymutil)
+    writer.variable('buildversion', self.buildversion)
     writer.variable('bundleidentifier', syntax.escape(self.bundleidentifier))
     writer.variable('deploymenttarget', self.deploymenttarget)
     writer.variable('entitlements', 'none')